@@ -1 +1,5 @@
-from .api import auth_api, private_user_api, user_api
+from .api import (auth_api, city_api, metrics_api, private_user_api,
+                  profiling_api, service_api, user_api)
+from .cookies import TokenVerifier
+from .middleware import (auth_middleware, metrics_middleware,
+                         profiling_middleware, query_count_middleware)
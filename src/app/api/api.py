@@ -1,28 +1,37 @@
-import json as json_
+import logging
+from hmac import compare_digest
 
 from pydantic import ValidationError
 from sanic import exceptions
 from sanic.blueprints import Blueprint
-from sanic.response import empty, json, text
+from sanic.response import HTTPResponse, empty, text
 from sanic_ext import openapi, validate
-from sqlalchemy.future import select
-from sqlalchemy.sql import delete
-from sqlalchemy.sql import text as text_
-from sqlalchemy.sql import update
-from werkzeug.security import check_password_hash, generate_password_hash
-
-from app.helpers import (check_admin, find_date, json_serial,
-                         request_validation, users_list)
-from app.model.tables import City, User
-
-from .cookies import create_token, verify_token
-from .model import (CRUDPrivateUsersListResponseModel,
+
+from app.db import statements
+from app.helpers import (Serializer, UserImport, admission_control,
+                         batch_delete, batch_update,
+                         cached_json, check_admin, conditional_response,
+                         export_users, find_date, json_response, make_etag,
+                         not_modified, not_modified_response,
+                         request_validation, unit_of_work, user_filters,
+                         users_list)
+
+from .cookies import current_login
+from .model import (BatchResultModel, CitiesCreate, CitiesHintModel, CitiesListResponseModel,
                     CurrentUserResponseModel, ErrorResponseModel,
-                    HTTPValidationError, LoginModel, PrivateCreateUserModel,
+                    HTTPValidationError, ImportReportModel, LoginModel,
+                    PrivateBatchDeleteModel, PrivateBatchUpdateModel,
+                    PrivateCreateUserModel,
                     PrivateDetailUserResponseModel, PrivateUpdateUserModel,
                     PrivateUsersListResponseModel, UpdateUserModel,
                     UpdateUserResponseModel, UsersListResponseModel)
 
+logger = logging.getLogger(__name__)
+
+current_user_serializer = Serializer(CurrentUserResponseModel)
+private_user_serializer = Serializer(PrivateDetailUserResponseModel)
+private_users_page = Serializer(PrivateUsersListResponseModel, exclude_none=True)
+
 
 def auth_api(di):
     auth = Blueprint('auth')
@@ -37,17 +46,19 @@ def auth_api(di):
     @openapi.body({"application/json": LoginModel}, required=True)
     @validate(json=LoginModel)
     @request_validation()
+    @admission_control(di)
+    @unit_of_work(di)
     async def login_login_post(request, body: LoginModel):
-        sql = select(User.__table__).where(User.email == body.login)
-        is_user = await di.db.row(sql)
+        is_user = await di.db.row(statements.user_by_email, {'email': body.login})
 
-        if is_user and check_password_hash(is_user['password_hash'], body.password):
+        if is_user and await di.hasher.verify(is_user['password_hash'], body.password):
+            if di.hasher.needs_rehash(is_user['password_hash']):
+                password_hash = await di.hasher.hash(body.password)
+                await di.db.exec(statements.user_set_password, {'pk': is_user['id'], 'password_hash': password_hash})
             [is_user.pop(key) for key in ['id', 'password_hash', 'additional_info', 'city']]
             response_user = CurrentUserResponseModel(**is_user)
-            token = create_token(di, body.login)
-            ser_data = json_.dumps(response_user.dict(), default=json_serial)
-            ser_data = json_.loads(ser_data)
-            response_ = json(ser_data)
+            token = di.tokens.create(body.login)
+            response_ = json_response(response_user)
             response_.cookies['token'] = token
             return response_
         else:
@@ -58,6 +69,8 @@ def auth_api(di):
     @openapi.summary("Выход из системы")
     @openapi.description("При успешном выходе удаляются установленные Cookies")
     @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @admission_control(di)
+    @unit_of_work(di)
     async def logout_logout_get(request):
         response_ = empty(200)
         del response_.cookies['token']
@@ -75,49 +88,82 @@ def user_api(di):
     @openapi.description("Здесь находится вся информация, доступная пользователю о самом себе, а так же информация "
                          "является ли он администратором")
     @openapi.response(200, {"application/json": CurrentUserResponseModel}, description='Successful Response')
+    @openapi.response(304, description='Not Modified')
     @openapi.response(400, {"application/json": ErrorResponseModel}, description='Bad Request')
     @openapi.response(401, {"application/json": 'Response 401 Current User Users Current Get'})
+    @openapi.parameter("If-None-Match", str, location="header")
     @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def current_user_users_current_get(request):
-        login_by_token = verify_token(di, request.cookies.get("token"))
-        table = User.__table__
-        sql = select(
-            table.c.first_name,
-            table.c.last_name,
-            table.c.email,
-            table.c.is_admin,
-            table.c.other_name,
-            table.c.phone,
-            table.c.birthday
-        ).where(User.email == login_by_token)
-        user_ = await di.db.row(sql)
-
-        if user_:
-            user__ = CurrentUserResponseModel(**user_)
-            ser_data = json_.dumps(user__.dict(), default=json_serial)
-            data = json_.loads(ser_data)
-            response_ = json(data)
-            return response_
-        else:
+        login_by_token = current_login(request)
+        principal = await di.principals.get(login_by_token)
+        if not principal:
             raise exceptions.Unauthorized("Response 401 Current User Users Current Get")
 
+        key = di.responses.key(request, principal['id'])
+        cached = di.responses.get(key)
+        if cached is None:
+            stamp = di.responses.stamp()
+            user_ = await di.db.row(statements.current_user, {'pk': principal['id']})
+            if not user_:
+                raise exceptions.Unauthorized("Response 401 Current User Users Current Get")
+
+            etag = make_etag('current', principal['id'], user_['version'])
+            if not_modified(request, etag, user_['updated_at']):
+                return not_modified_response(etag, user_['updated_at'])
+            cached = di.responses.set(key, stamp, ['user:{}'.format(principal['id'])],
+                                      cached_json(current_user_serializer(user_), etag, user_['updated_at']))
+        return conditional_response(request, cached)
+
     @user.get('/')
     @openapi.tag("user")
     @openapi.summary("Постраничное получение кратких данных обо всех пользователях")
-    @openapi.description("Здесь находится вся информация, доступная пользователю о других пользователях")
+    @openapi.description("Здесь находится вся информация, доступная пользователю о других пользователях. "
+                         "Для постраничного получения по курсору передается заголовок Cursor (пустой для первой "
+                         "страницы), далее — значения meta.pagination.next_cursor / prev_cursor. "
+                         "Сортировка — параметр sort: id, name, last_name, first_name, email, birthday, city "
+                         "(с префиксом «-» — по убыванию; по курсору — только id и name). Фильтры: city, is_admin, "
+                         "birthday_from, birthday_to (YYYY-MM-DD), prefix (начало имени, фамилии или email), "
+                         "search (подстрока имени или фамилии)")
     @openapi.response(200, {"application/json": UsersListResponseModel}, description='Successful Response')
+    @openapi.response(304, description='Not Modified')
     @openapi.response(400, {"application/json": ErrorResponseModel}, description='Bad Request')
     @openapi.response(401, {"application/json": 'Response 401 Current User Users Current Get'})
     @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
-    @openapi.parameter("Page", int, location="header", required=True)
+    @openapi.parameter("Page", int, location="header")
     @openapi.parameter("Size", int, location="header", required=True)
+    @openapi.parameter("Cursor", str, location="header")
+    @openapi.parameter("sort", str, location="query")
+    @openapi.parameter("city", int, location="query")
+    @openapi.parameter("is_admin", bool, location="query")
+    @openapi.parameter("birthday_from", str, location="query")
+    @openapi.parameter("birthday_to", str, location="query")
+    @openapi.parameter("prefix", str, location="query")
+    @openapi.parameter("search", str, location="query")
+    @openapi.parameter("If-None-Match", str, location="header")
     @request_validation(pagination=True, check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def users_users_get(request):
-        page = int(request.headers.get('Page', None))
-        size = int(request.headers.get('Size', None))
-        verify_token(di, request.cookies.get("token"))
-        response_ = json(await users_list(di, page, size))
-        return response_
+        cursor = request.headers.get('Cursor', None)
+        page, size = request.ctx.page, request.ctx.size
+        sort = request.args.get('sort', 'id')
+        login_by_token = current_login(request)
+        principal = await di.principals.get(login_by_token)
+        if not principal:
+            raise exceptions.Unauthorized("Response 401 Current User Users Current Get")
+
+        key = di.responses.key(request, principal['id'])
+        cached = di.responses.get(key)
+        if cached is None:
+            stamp = di.responses.stamp()
+            users_list_, etag = await users_list(di, page, size, cursor=cursor, sort=sort,
+                                                 filters=user_filters(request.args))
+            if not_modified(request, etag):
+                return not_modified_response(etag)
+            cached = di.responses.set(key, stamp, ['users'], cached_json(users_list_, etag))
+        return conditional_response(request, cached)
 
     @user.patch('/<pk>', strict_slashes=True)
     @openapi.tag("user")
@@ -132,46 +178,35 @@ def user_api(di):
     @openapi.body({"application/json": UpdateUserModel}, required=True)
     @validate(json=UpdateUserModel)
     @request_validation(check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def edit_user_users__pk__patch(request, pk, body: UpdateUserModel):
         pk = int(pk)
-        login_by_token = verify_token(di, request.cookies.get("token"))
+        login_by_token = current_login(request)
 
-        sql = select(User.__table__).where(User.email == login_by_token)
-        user_by_login = await di.db.row(sql)
-        sql = select(User.__table__.c.id).where(User.id == pk)
-        user_by_pk = await di.db.row(sql)
+        user_by_login = await di.principals.get(login_by_token)
+        user_by_pk = await di.db.row(statements.user_lock, {'pk': pk})
 
         if not user_by_login:
             raise exceptions.Unauthorized("Response 401 Current User Users Current Get")
         if not user_by_pk:
             raise exceptions.NotFound('Response 404 Edit User Users  Pk  Patch')
-        if user_by_login('id') != user_by_pk['id']:
+        if user_by_login['id'] != user_by_pk['id']:
             raise exceptions.Unauthorized("Response 401 Current User Users Current Get")
 
         body = body.dict()
         body['id'] = pk
         body['birthday'] = find_date(body['birthday'])
         try:
-            UpdateUserResponseModel(**body)
+            user_ = UpdateUserResponseModel(**body)
         except ValidationError as e:
-            print(e.json())
+            logger.info('response validation failed: %s', e.json())
             raise exceptions.SanicException("Validation Error", status_code=422)
 
-        sql = text_('''
-            UPDATE users SET 
-            first_name = :first_name,
-            last_name = :last_name,
-            email = :email,
-            other_name = :other_name,
-            phone = :phone,
-            birthday = :birthday
-            WHERE
-            id = :id
-        ''')
-        user_ = await di.db.update(sql, body)
-        ser_data = json_.dumps(user_, default=json_serial)
-        data = json_.loads(ser_data)
-        response_ = json(data)
+        await di.db.update(statements.user_update_self, body)
+        di.principals.invalidate_id(pk)
+        di.responses.invalidate('user:{}'.format(pk), 'users')
+        response_ = json_response(user_)
         return response_
 
     return user
@@ -179,31 +214,66 @@ def user_api(di):
 
 def private_user_api(di):
     private_user = Blueprint('admin', url_prefix='/private/users')
+    batch_max_size = int(di.config.get('batch', {}).get('max_size', 1000))
 
     @private_user.get('/')
     @openapi.tag("admin")
     @openapi.summary("Постраничное получение кратких данных обо всех пользователях")
-    @openapi.description("Здесь находится вся информация, доступная пользователю о других пользователях")
+    @openapi.description("Здесь находится вся информация, доступная пользователю о других пользователях. "
+                         "Для постраничного получения по курсору передается заголовок Cursor (пустой для первой "
+                         "страницы), далее — значения meta.pagination.next_cursor / prev_cursor. "
+                         "Сортировка — параметр sort: id, name, last_name, first_name, email, birthday, city "
+                         "(с префиксом «-» — по убыванию; по курсору — только id и name). Фильтры: city, is_admin, "
+                         "birthday_from, birthday_to (YYYY-MM-DD), prefix (начало имени, фамилии или email), "
+                         "search (подстрока имени или фамилии). Версия справочника городов возвращается в "
+                         "заголовке Hint-ETag; если передать ее в Hint-If-None-Match, meta.hint не отправляется")
     @openapi.response(200, {"application/json": PrivateUsersListResponseModel}, description='Successful Response')
+    @openapi.response(304, description='Not Modified')
     @openapi.response(400, {"application/json": ErrorResponseModel}, description='Bad Request')
     @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
     @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
     @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
-    @openapi.parameter("Page", int, location="header", required=True)
+    @openapi.parameter("Page", int, location="header")
     @openapi.parameter("Size", int, location="header", required=True)
+    @openapi.parameter("Cursor", str, location="header")
+    @openapi.parameter("sort", str, location="query")
+    @openapi.parameter("city", int, location="query")
+    @openapi.parameter("is_admin", bool, location="query")
+    @openapi.parameter("birthday_from", str, location="query")
+    @openapi.parameter("birthday_to", str, location="query")
+    @openapi.parameter("prefix", str, location="query")
+    @openapi.parameter("search", str, location="query")
+    @openapi.parameter("Hint-If-None-Match", str, location="header")
+    @openapi.parameter("If-None-Match", str, location="header")
     @request_validation(pagination=True, check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def private_users_private_users_get(request):
-        page = int(request.headers.get('Page', None))
-        size = int(request.headers.get('Size', None))
-        login_by_token = verify_token(di, request.cookies.get("token"))
-        await check_admin(di, login_by_token)
-
-        users_list_ = await users_list(di, page, size)
-        sql = select(City.__table__)
-        cities_list = await di.db.list(sql)
-        len_pages = users_list_['meta']['pagination']['total']
-        data = CRUDPrivateUsersListResponseModel.create(users_list_['data'], page, size, len_pages, cities_list)
-        response_ = json(data.dict())
+        cursor = request.headers.get('Cursor', None)
+        page, size = request.ctx.page, request.ctx.size
+        sort = request.args.get('sort', 'id')
+        login_by_token = current_login(request)
+        principal = await check_admin(di, login_by_token)
+
+        cities_list, cities_etag = await di.cities.all()
+        key = di.responses.key(request, principal['id'])
+        cached = di.responses.get(key)
+        if cached is None:
+            stamp = di.responses.stamp()
+            users_list_, etag = await users_list(di, page, size, cursor=cursor, sort=sort,
+                                                 filters=user_filters(request.args))
+            if request.headers.get('Hint-If-None-Match') == cities_etag:
+                cities_list = None
+            etag = make_etag(etag, cities_etag if cities_list is not None else None)
+            if not_modified(request, etag):
+                response_ = not_modified_response(etag)
+                response_.headers['Hint-ETag'] = cities_etag
+                return response_
+            meta = {**users_list_['meta'], 'hint': None if cities_list is None else {'city': cities_list}}
+            data = private_users_page({'data': users_list_['data'], 'meta': meta})
+            cached = di.responses.set(key, stamp, ['users', 'cities'], cached_json(data, etag))
+        response_ = conditional_response(request, cached)
+        response_.headers['Hint-ETag'] = cities_etag
         return response_
 
     @private_user.post('/')
@@ -218,22 +288,139 @@ def private_user_api(di):
     @openapi.body({"application/json": PrivateCreateUserModel}, required=True)
     @validate(json=PrivateCreateUserModel)
     @request_validation(pagination=False, check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def private_create_users_private_users_post(request, body: PrivateCreateUserModel):
-        login_by_token = verify_token(di, request.cookies.get("token"))
+        login_by_token = current_login(request)
         await check_admin(di, login_by_token)
 
         body = body.dict()
-        body['password_hash'] = generate_password_hash(body.pop('password'))
-        sql = User.__table__.insert()
-        added_user_id = await di.db.exec(sql, body)
+        body['password_hash'] = await di.hasher.hash(body.pop('password'))
+        added_user_id = await di.db.exec(statements.user_insert, body)
         if not added_user_id:
             raise exceptions.Forbidden("Response 403 Private Users Private Users Get")
+        await di.users_count.changed(1)
+        di.responses.invalidate('users')
         body.pop('password_hash')
         body['id'] = added_user_id
-        ser_data = json_.dumps(body, default=json_serial)
-        data = json_.loads(ser_data)
-        added_user = PrivateDetailUserResponseModel(**data)
-        response_ = json(added_user.dict(), status=201)
+        added_user = PrivateDetailUserResponseModel(**body)
+        response_ = json_response(added_user, status=201)
+        return response_
+
+    @private_user.post('/import', stream=True)
+    @openapi.tag("admin")
+    @openapi.summary("Массовое создание пользователей")
+    @openapi.description("Здесь возможно загрузить пользователей потоком в формате NDJSON (application/x-ndjson) "
+                         "или CSV (text/csv, первая строка — заголовок) с полями модели PrivateCreateUserModel. "
+                         "Ошибочные строки и повторяющиеся email попадают в отчет и не прерывают загрузку")
+    @openapi.response(200, {"application/json": ImportReportModel}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_import_users_private_users_import_post(request):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+        await di.db.commit_scope()
+
+        csv_format = request.headers.get('Content-Type', '').startswith('text/csv')
+        report = await UserImport(di, csv_format=csv_format).run(request.stream)
+        if report['inserted']:
+            di.responses.invalidate('users')
+        response_ = json_response(report)
+        return response_
+
+    @private_user.get('/export')
+    @openapi.tag("admin")
+    @openapi.summary("Выгрузка пользователей")
+    @openapi.description("Здесь администратор может выгрузить всех пользователей или их часть потоком в формате "
+                         "NDJSON или CSV. Параметры: format (ndjson | csv), columns (поля через запятую), "
+                         "gzip (1 — файл .gz, application/gzip), фильтры как у списка пользователей")
+    @openapi.response(200, {"application/x-ndjson": str, "text/csv": str, "application/gzip": str},
+                      description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.parameter("format", str, location="query")
+    @openapi.parameter("columns", str, location="query")
+    @openapi.parameter("gzip", int, location="query")
+    @openapi.parameter("city", int, location="query")
+    @openapi.parameter("is_admin", bool, location="query")
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_export_users_private_users_export_get(request):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+        await di.db.commit_scope()
+
+        await export_users(di, request)
+
+    @private_user.patch('/batch')
+    @openapi.tag("admin")
+    @openapi.summary("Массовое изменение пользователей")
+    @openapi.description("Здесь администратор может изменить нескольких пользователей одним запросом. "
+                         "Изменяются только переданные поля, результат возвращается для каждого id: "
+                         "updated, skipped, not_found, conflict (email занят) или invalid_city")
+    @openapi.response(200, {"application/json": BatchResultModel}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.body({"application/json": PrivateBatchUpdateModel}, required=True)
+    @validate(json=PrivateBatchUpdateModel)
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_batch_patch_users_private_users_batch_patch(request, body: PrivateBatchUpdateModel):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        items = [item.dict(exclude_unset=True) for item in body.users]
+        ids = [item['id'] for item in items]
+        if not items or len(items) > batch_max_size or len(set(ids)) != len(ids):
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        statuses = await batch_update(di, items)
+        updated = [pk for pk, status in statuses.items() if status == 'updated']
+        for pk in updated:
+            di.principals.invalidate_id(pk)
+        di.responses.invalidate('users', *['user:{}'.format(pk) for pk in updated])
+        results = [{'id': item['id'], 'status': statuses.get(item['id'], 'skipped')} for item in items]
+        response_ = json_response({'results': results})
+        return response_
+
+    @private_user.delete('/batch', ignore_body=False)
+    @openapi.tag("admin")
+    @openapi.summary("Массовое удаление пользователей")
+    @openapi.description("Здесь администратор может удалить пользователей по списку id и/или по фильтру "
+                         "(city, is_admin) одним запросом")
+    @openapi.response(200, {"application/json": BatchResultModel}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.body({"application/json": PrivateBatchDeleteModel}, required=True)
+    @validate(json=PrivateBatchDeleteModel)
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_batch_delete_users_private_users_batch_delete(request, body: PrivateBatchDeleteModel):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        filters = body.filter.dict(exclude_none=True) if body.filter else {}
+        if (body.ids is None and not filters) or (body.ids is not None and len(body.ids) > batch_max_size):
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        deleted = await batch_delete(di, ids=body.ids, filters=filters)
+        if deleted:
+            await di.users_count.changed(-len(deleted))
+        for pk in deleted:
+            di.principals.invalidate_id(pk)
+        di.responses.invalidate('users', *['user:{}'.format(pk) for pk in deleted])
+        if body.ids is not None:
+            results = [{'id': pk, 'status': 'deleted' if pk in deleted else 'not_found'} for pk in body.ids]
+        else:
+            results = [{'id': pk, 'status': 'deleted'} for pk in sorted(deleted)]
+        response_ = json_response({'results': results})
         return response_
 
     @private_user.get('/<pk>', strict_slashes=True)
@@ -241,27 +428,35 @@ def private_user_api(di):
     @openapi.summary("Детальное получение информации о пользователе")
     @openapi.description("Здесь администратор может увидеть всю существующую пользовательскую информацию")
     @openapi.response(200, {"application/json": PrivateDetailUserResponseModel}, description='Successful Response')
+    @openapi.response(304, description='Not Modified')
     @openapi.response(400, {"application/json": ErrorResponseModel}, description='Bad Request')
     @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
     @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
     @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
     @openapi.parameter("pk", int, location="query")
+    @openapi.parameter("If-None-Match", str, location="header")
     @request_validation(pagination=False, check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def private_get_user_private_users__pk__get(request, pk):
         pk = int(pk)
-        login_by_token = verify_token(di, request.cookies.get("token"))
-        await check_admin(di, login_by_token)
-
-        sql = select(User.__table__).where(User.id == pk)
-        request_user = await di.db.row(sql)
-        if not request_user:
-            raise exceptions.Forbidden("Response 403 Private Users Private Users Get")
-        request_user.pop('password_hash')
-        added_user = PrivateDetailUserResponseModel(**request_user)
-        ser_data = json_.dumps(added_user.dict(), default=json_serial)
-        data = json_.loads(ser_data)
-        response_ = json(data)
-        return response_
+        login_by_token = current_login(request)
+        principal = await check_admin(di, login_by_token)
+
+        key = di.responses.key(request, principal['id'])
+        cached = di.responses.get(key)
+        if cached is None:
+            stamp = di.responses.stamp()
+            request_user = await di.db.row(statements.user_by_id, {'pk': pk})
+            if not request_user:
+                raise exceptions.Forbidden("Response 403 Private Users Private Users Get")
+            etag = make_etag('private', pk, request_user['version'])
+            if not_modified(request, etag, request_user['updated_at']):
+                return not_modified_response(etag, request_user['updated_at'])
+            cached = di.responses.set(key, stamp, ['user:{}'.format(pk)],
+                                      cached_json(private_user_serializer(request_user), etag,
+                                                  request_user['updated_at']))
+        return conditional_response(request, cached)
 
     @private_user.delete('/<pk>', strict_slashes=True)
     @openapi.tag("admin")
@@ -274,13 +469,18 @@ def private_user_api(di):
     @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
     @openapi.parameter("pk", int, location="query")
     @request_validation(check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def private_delete_user_private_users__pk__delete(request, pk):
         pk = int(pk)
-        login_by_token = verify_token(di, request.cookies.get("token"))
+        login_by_token = current_login(request)
         await check_admin(di, login_by_token)
 
-        sql = delete(User.__table__).where(User.id == pk)
-        await di.db.exec(sql)
+        deleted_id = await di.db.val(statements.user_delete, {'pk': pk})
+        if deleted_id is not None:
+            await di.users_count.changed(-1)
+            di.principals.invalidate_id(pk)
+            di.responses.invalidate('user:{}'.format(pk), 'users')
         return text('Successful Response', status=204)
 
     @private_user.patch('/<pk>', strict_slashes=True)
@@ -295,23 +495,276 @@ def private_user_api(di):
     @openapi.parameter("pk", int, location="query")
     @validate(json=PrivateUpdateUserModel)
     @request_validation(check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
     async def private_patch_user_private_users__pk__patch(request, pk, body: PrivateUpdateUserModel):
-        login_by_token = verify_token(di, request.cookies.get("token"))
+        login_by_token = current_login(request)
         await check_admin(di, login_by_token)
 
         body = body.dict()
         body['birthday'] = find_date(body['birthday'])
-        sql = update(User.__table__).where(User.id == int(pk))
-        await di.db.update(sql, body)
+        await di.db.update(statements.user_update, {**body, 'pk': int(pk)})
+        di.principals.invalidate_id(int(pk))
+        di.responses.invalidate('user:{}'.format(pk), 'users')
         body['id'] = int(pk)
-        ser_data = json_.dumps(body, default=json_serial)
-        data = json_.loads(ser_data)
         try:
-            user_ = PrivateDetailUserResponseModel(**data)
+            user_ = PrivateDetailUserResponseModel(**body)
         except ValidationError as e:
-            print(e.json())
+            logger.info('response validation failed: %s', e.json())
             raise exceptions.SanicException("Validation Error", status_code=422)
-        response_ = json(user_.dict())
+        response_ = json_response(user_)
         return response_
 
     return private_user
+
+
+def city_api(di):
+    city = Blueprint('city', url_prefix='/private/cities')
+
+    def city_name(body):
+        name = body.name.strip()
+        if not name:
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        return name
+
+    @city.get('/')
+    @openapi.tag("admin")
+    @openapi.summary("Справочник городов")
+    @openapi.description("Список всех городов. Ответ содержит заголовок ETag, при совпадении If-None-Match "
+                         "возвращается 304 без тела")
+    @openapi.response(200, {"application/json": CitiesListResponseModel}, description='Successful Response')
+    @openapi.response(304, description='Not Modified')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.parameter("If-None-Match", str, location="header")
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_cities_private_cities_get(request):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        cities_list, etag = await di.cities.all()
+        if not_modified(request, etag):
+            return not_modified_response(etag)
+        return json_response({'data': cities_list}, headers={'ETag': etag})
+
+    @city.post('/')
+    @openapi.tag("admin")
+    @openapi.summary("Создание города")
+    @openapi.description("Добавление города в справочник")
+    @openapi.response(201, {"application/json": CitiesHintModel}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.body({"application/json": CitiesCreate}, required=True)
+    @validate(json=CitiesCreate)
+    @request_validation(check_token=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_create_city_private_cities_post(request, body: CitiesCreate):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        name = city_name(body)
+        pk = await di.db.val(statements.city_insert, {'name': name})
+        if pk is None:
+            raise exceptions.Forbidden('city already exists')
+        await di.cities.changed()
+        di.responses.invalidate('cities')
+        return json_response({'id': pk, 'name': name}, status=201)
+
+    @city.patch('/<pk>', strict_slashes=True)
+    @openapi.tag("admin")
+    @openapi.summary("Изменение города")
+    @openapi.description("Переименование города в справочнике")
+    @openapi.response(200, {"application/json": CitiesHintModel}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(404, {"application/json": ErrorResponseModel}, description='Not Found')
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.parameter("pk", int, location="query")
+    @openapi.body({"application/json": CitiesCreate}, required=True)
+    @validate(json=CitiesCreate)
+    @request_validation(check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_patch_city_private_cities__pk__patch(request, pk, body: CitiesCreate):
+        pk = int(pk)
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        name = city_name(body)
+        if await di.db.val(statements.city_rename, {'pk': pk, 'name': name}) is None:
+            raise exceptions.NotFound('city not found')
+        await di.cities.changed()
+        di.responses.invalidate('cities')
+        return json_response({'id': pk, 'name': name})
+
+    @city.delete('/<pk>', strict_slashes=True)
+    @openapi.tag("admin")
+    @openapi.summary("Удаление города")
+    @openapi.description("Удаление города, на который не ссылается ни один пользователь")
+    @openapi.response(204, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @openapi.response(404, {"application/json": ErrorResponseModel}, description='Not Found')
+    @openapi.response(422, {"application/json": HTTPValidationError}, description='Validation Error')
+    @openapi.parameter("pk", int, location="query")
+    @request_validation(check_token=True, check_pk=True)
+    @admission_control(di)
+    @unit_of_work(di)
+    async def private_delete_city_private_cities__pk__delete(request, pk):
+        pk = int(pk)
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        if await di.db.val(statements.user_in_city, {'city': pk}) is not None:
+            raise exceptions.Forbidden('city is in use')
+        if await di.db.val(statements.city_delete, {'pk': pk}) is None:
+            raise exceptions.NotFound('city not found')
+        await di.cities.changed()
+        di.responses.invalidate('cities')
+        return text('Successful Response', status=204)
+
+    return city
+
+
+def service_api(di):
+    service = Blueprint('service', url_prefix='/private/stats')
+
+    @service.get('/')
+    @openapi.tag("admin")
+    @openapi.summary("Статистика сервиса")
+    @openapi.description("Здесь администратор может увидеть состояние пула соединений с БД и кэшей")
+    @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @openapi.response(401, {"application/json": 'Response 401 Private Users Private Users Get'})
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @request_validation(check_token=True)
+    async def service_stats_private_stats_get(request):
+        login_by_token = current_login(request)
+        await check_admin(di, login_by_token)
+
+        data = {
+            'db': {
+                'pool': di.db.pool_status(),
+                'statements': di.db.query_log.stats(),
+                'replicas': di.db.replica_status(),
+            },
+            'cache': {
+                'principal': di.principals.stats(),
+                'city': di.cities.stats(),
+                'response': di.responses.stats(),
+                'token': di.tokens.stats(),
+            },
+            'password_hasher': di.hasher.stats(),
+            'admission': di.admission.stats(),
+        }
+        return json_response(data)
+
+    return service
+
+
+def metrics_api(di):
+    metrics = Blueprint('metrics')
+    token = di.config.get('metrics_token') or di.config.get('metrics', {}).get('token') or ''
+    if not token:
+        raise ValueError('metrics.enabled requires metrics_token in .env (or metrics.token)')
+
+    @metrics.get('/metrics')
+    @openapi.tag("service")
+    @openapi.summary("Метрики Prometheus")
+    @openapi.description("Метрики процесса в текстовом формате Prometheus, с заголовком "
+                         "`Authorization: Bearer <token>` (`metrics_token`)")
+    @openapi.response(200, {"text/plain": str}, description='Successful Response')
+    @openapi.response(401, {"application/json": ErrorResponseModel}, description='Unauthorized')
+    async def metrics_metrics_get(request):
+        if not compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+            raise exceptions.Unauthorized('metrics token required')
+        return HTTPResponse(di.metrics.render(), content_type=di.metrics.registry.CONTENT_TYPE)
+
+    return metrics
+
+
+def profiling_api(di):
+    profiling = Blueprint('profiling', url_prefix='/private/profiles')
+
+    @profiling.get('/')
+    @openapi.tag("admin")
+    @openapi.summary("Список профилей запросов")
+    @openapi.description("Профили запросов, снятые в этом процессе: по заголовку `X-Profile` от администратора "
+                         "или по `profiling.sample_rate`")
+    @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @openapi.response(403, {"application/json": 'Response 403 Private Users Private Users Get'})
+    @request_validation(check_token=True)
+    async def private_profiles_private_profiles_get(request):
+        await check_admin(di, current_login(request))
+        return json_response({'data': di.profiler.list(), 'stats': di.profiler.stats()})
+
+    @profiling.get('/memory')
+    @openapi.tag("admin")
+    @openapi.summary("Рост памяти с момента снимка")
+    @openapi.description("Разница снимков tracemalloc с базовым: `group` (lineno, filename, traceback), "
+                         "`limit`, `reset=1` делает текущий снимок базовым")
+    @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @openapi.response(404, {"application/json": ErrorResponseModel}, description='Tracing is off')
+    @request_validation(check_token=True)
+    async def private_memory_diff_private_profiles_memory_get(request):
+        await check_admin(di, current_login(request))
+        group = request.args.get('group', 'lineno')
+        if group not in ('lineno', 'filename', 'traceback'):
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        diff = di.profiler.memory_diff(group, limit, request.args.get('reset') == '1')
+        if diff is None:
+            raise exceptions.NotFound('tracemalloc is not started')
+        return json_response({'data': diff, 'status': di.profiler.memory_status()})
+
+    @profiling.post('/memory')
+    @openapi.tag("admin")
+    @openapi.summary("Базовый снимок памяти")
+    @openapi.description("Включает tracemalloc в этом процессе и снимает базовый снимок")
+    @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @request_validation(check_token=True)
+    async def private_memory_start_private_profiles_memory_post(request):
+        await check_admin(di, current_login(request))
+        return json_response(di.profiler.memory_start())
+
+    @profiling.delete('/memory')
+    @openapi.tag("admin")
+    @openapi.summary("Выключение tracemalloc")
+    @openapi.response(200, {"application/json": None}, description='Successful Response')
+    @request_validation(check_token=True)
+    async def private_memory_stop_private_profiles_memory_delete(request):
+        await check_admin(di, current_login(request))
+        return json_response(di.profiler.memory_stop())
+
+    @profiling.get('/<pk:[0-9]+-[0-9]+>', strict_slashes=True)
+    @openapi.tag("admin")
+    @openapi.summary("Профиль запроса")
+    @openapi.description("`format`: text (pstats, `sort`, `limit`), pstats (файл для `pstats.Stats`) "
+                         "или collapsed (свернутые стеки для flame graph)")
+    @openapi.parameter("pk", str, location="query")
+    @openapi.response(200, {"text/plain": str}, description='Successful Response')
+    @openapi.response(404, {"application/json": ErrorResponseModel}, description='Not Found')
+    @request_validation(check_token=True)
+    async def private_profile_private_profiles__pk__get(request, pk):
+        await check_admin(di, current_login(request))
+        fmt = request.args.get('format', 'text')
+        sort = request.args.get('sort', 'cumulative')
+        if fmt not in ('text', 'pstats', 'collapsed') or sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        try:
+            limit = int(request.args.get('limit', 40))
+        except ValueError:
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        rendered = di.profiler.render(pk, fmt, sort, limit)
+        if rendered is None:
+            raise exceptions.NotFound('profile not found')
+        body, content_type = rendered
+        return HTTPResponse(body, content_type=content_type)
+
+    return profiling
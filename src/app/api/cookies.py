@@ -1,37 +1,75 @@
 from datetime import datetime, timedelta
+from time import time
 
 import jwt
+from jwt.algorithms import get_default_algorithms
 from sanic.exceptions import Unauthorized
 
+from app.abs import IDi
+from app.cache import LRUCache
 
-def create_token(di, email):
-    payload = {
-        'exp': datetime.utcnow() + timedelta(seconds=di.config['web']['jwt_lifespan']),
-        'email': str(email)
-    }
-    token = jwt.encode(
-        payload,
-        di.config['web']['jwt_secret'],
-        algorithm=di.config['web']['jwt_algorithm'],
-    )
-    return token
-
-
-def verify_token(di, token):
-    try:
-        payload = jwt.decode(
-            token,
-            di.config['web']['jwt_secret'],
-            algorithms=[di.config['web']['jwt_algorithm']],
-        )
-    except:
-        raise Unauthorized("Response 401 Current User Users Current Get")
-    return payload.get('email')
 
+class TokenVerifier(IDi):
+    """Issues and checks the JWT kept in the ``token`` cookie.
 
+    Keys are prepared once. New tokens are signed with ``jwt_secret`` and
+    carry ``jwt_kid`` in the header; ``jwt_retired_keys`` ({kid: secret})
+    still verify until the tokens signed with them expire, which allows
+    rotating the secret without logging everyone out. Verified tokens are
+    cached with their claims until ``exp``.
+    """
 
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config['web']
+        self._algorithm = config['jwt_algorithm']
+        self._lifespan = timedelta(seconds=int(config['jwt_lifespan']))
+        self._kid = str(config.get('jwt_kid', '1'))
+        prepare = get_default_algorithms()[self._algorithm].prepare_key
+        self._signing_key = prepare(config['jwt_secret'])
+        self._keys = {str(kid): prepare(secret) for kid, secret in (config.get('jwt_retired_keys') or {}).items()}
+        self._keys[self._kid] = self._signing_key
+        cache = di.config.get('token_cache', {})
+        self._ttl = float(cache.get('ttl', 300))
+        self._cache = LRUCache(int(cache.get('maxsize', 10000)), self._ttl)
 
+    def create(self, email):
+        payload = {
+            'exp': datetime.utcnow() + self._lifespan,
+            'email': str(email)
+        }
+        return jwt.encode(payload, self._signing_key, algorithm=self._algorithm, headers={'kid': self._kid})
 
+    def verify(self, token):
+        """Returns the claims of a valid token, ``None`` otherwise."""
+        if not token:
+            return None
+        claims = self._cache.get(token)
+        if claims is not None:
+            if claims['exp'] > time():
+                return claims
+            self._cache.pop(token)
+            return None
+        try:
+            kid = jwt.get_unverified_header(token).get('kid', self._kid)
+            key = self._keys.get(kid)
+            if key is None:
+                return None
+            claims = jwt.decode(token, key, algorithms=[self._algorithm], options={'require': ['exp']})
+        except jwt.PyJWTError:
+            return None
+        ttl = min(claims['exp'] - time(), self._ttl)
+        if ttl > 0:
+            self._cache.set(token, claims, ttl=ttl)
+        return claims
 
+    def stats(self):
+        return {**self._cache.stats(), 'kid': self._kid, 'keys': len(self._keys)}
 
 
+def current_login(request):
+    """Login (email) of the request principal, set by ``auth_middleware``."""
+    login = getattr(request.ctx, 'login', None)
+    if login is None:
+        raise Unauthorized("Response 401 Current User Users Current Get")
+    return login
@@ -0,0 +1,80 @@
+from time import perf_counter
+
+
+def auth_middleware(di):
+    app = di.app
+
+    @app.middleware('request')
+    async def verify_token_once(request):
+        claims = di.tokens.verify(request.cookies.get('token'))
+        request.ctx.login = None if claims is None else claims.get('email')
+
+
+def query_count_middleware(di):
+    """Adds ``X-DB-Queries`` with the number of statements a request ran (load tests, ``bench.api``)."""
+    app = di.app
+
+    @app.middleware('request')
+    async def query_count_start(request):
+        di.db.count_queries()
+
+    @app.middleware('response')
+    async def query_count_header(request, response):
+        count = di.db.counted_queries()
+        if count is not None:
+            response.headers['X-DB-Queries'] = str(count)
+
+
+def metrics_middleware(di):
+    """Records count, status and latency of every request in ``di.metrics``.
+
+    Registered before the other middleware, so its response hook runs last
+    and the latency includes the commit of the request transaction.
+    """
+    app = di.app
+
+    @app.middleware('request')
+    async def metrics_start(request):
+        request.ctx.metrics_start = perf_counter()
+
+    @app.middleware('response')
+    async def metrics_record(request, response):
+        start = getattr(request.ctx, 'metrics_start', None)
+        if start is not None:
+            di.metrics.observe(request, response.status, perf_counter() - start)
+
+
+def profiling_middleware(di, *blueprints):
+    """Profiles requests of ``blueprints`` with ``di.profiler`` (header from an admin, or sampled).
+
+    Blueprint middleware runs after the app-wide middleware in both
+    directions: the principal is already known, and the profile covers the
+    handler and the commit of the request transaction.
+    """
+    profiler = di.profiler
+
+    async def profile_start(request):
+        trigger = profiler.trigger(request)
+        if trigger is None:
+            return
+        if trigger == 'header':
+            login = getattr(request.ctx, 'login', None)
+            principal = await di.principals.get(login) if login is not None else None
+            if not principal or not principal['is_admin']:
+                return
+        profile = profiler.start()
+        if profile is not None:
+            request.ctx.profile = (profile, trigger)
+
+    async def profile_stop(request, response):
+        profile = getattr(request.ctx, 'profile', None)
+        if profile is None:
+            return
+        request.ctx.profile = None
+        pid = profiler.stop(profile[0], request, response.status, profile[1])
+        if profile[1] == 'header':
+            response.headers['X-Profile-Id'] = pid
+
+    for blueprint in blueprints:
+        blueprint.middleware(profile_start, 'request')
+        blueprint.middleware(profile_stop, 'response')
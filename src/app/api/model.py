@@ -1,7 +1,7 @@
 from datetime import date
 from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, constr, validator
 
 
 class LoginModel(BaseModel):
@@ -47,8 +47,11 @@ class UsersListElementModel(BaseModel):
 
 class PaginatedMetaDataModel(BaseModel):
     total: int
-    page: int
+    exact: Optional[bool]
+    page: Optional[int]
     size: int
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
 
 
 class UsersListMetaDataModel(BaseModel):
@@ -60,21 +63,6 @@ class UsersListResponseModel(BaseModel):
     meta: UsersListMetaDataModel
 
 
-class CRUDUsersListResponseModel(UsersListResponseModel):
-    @staticmethod
-    def create(users, total_pages, page, size):
-        return UsersListResponseModel(
-            data=users,
-            meta=UsersListMetaDataModel(
-                pagination=PaginatedMetaDataModel(
-                    total=total_pages,
-                    page=page,
-                    size=size
-                )
-            )
-        )
-
-
 class UpdateUserModel(BaseModel):
     first_name: str
     last_name: str
@@ -100,7 +88,7 @@ class PrivateUsersListHintMetaModel(BaseModel):
 
 class PrivateUsersListMetaDataModel(BaseModel):
     pagination: PaginatedMetaDataModel
-    hint: PrivateUsersListHintMetaModel
+    hint: Optional[PrivateUsersListHintMetaModel]
 
 
 class PrivateUsersListResponseModel(BaseModel):
@@ -108,29 +96,14 @@ class PrivateUsersListResponseModel(BaseModel):
     meta: PrivateUsersListMetaDataModel
 
 
-class CRUDPrivateUsersListResponseModel(PrivateUsersListResponseModel):
-    @staticmethod
-    def create(data, page, size, total, cities):
-        return PrivateUsersListResponseModel(
-            data=data,
-            meta=PrivateUsersListMetaDataModel(
-                pagination=PaginatedMetaDataModel(
-                    size=size,
-                    page=page,
-                    total=total
-                ),
-                hint=PrivateUsersListHintMetaModel(
-                    city=cities
-                )
-
-            )
-        )
-
-
 class CitiesCreate(BaseModel):
     name: str
 
 
+class CitiesListResponseModel(BaseModel):
+    data: List[CitiesHintModel]
+
+
 class PrivateUser(BaseModel):
     first_name: str
     last_name: str
@@ -149,7 +122,62 @@ class PrivateCreateUserModel(PrivateUser):
 
 class PrivateDetailUserResponseModel(PrivateUser):
     id: int
+
+
+class ImportErrorModel(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReportModel(BaseModel):
+    received: int
+    inserted: int
+    duplicates: int
+    failed: int
+    errors: List[ImportErrorModel]
+
+
+class PrivateBatchUpdateItemModel(BaseModel):
+    id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    email: Optional[EmailStr]
+    is_admin: Optional[bool]
+    other_name: Optional[str]
+    phone: Optional[str]
     birthday: Optional[str]
+    city: Optional[int]
+    additional_info: Optional[str]
+
+    @validator('first_name', 'last_name', 'email', 'is_admin', pre=True)
+    def not_null(cls, value):
+        # may be left out, but not cleared: the columns are required
+        if value is None:
+            raise ValueError('none is not an allowed value')
+        return value
+
+
+class PrivateBatchUpdateModel(BaseModel):
+    users: List[PrivateBatchUpdateItemModel]
+
+
+class PrivateBatchDeleteFilterModel(BaseModel):
+    city: Optional[int]
+    is_admin: Optional[bool]
+
+
+class PrivateBatchDeleteModel(BaseModel):
+    ids: Optional[List[int]]
+    filter: Optional[PrivateBatchDeleteFilterModel]
+
+
+class BatchResultItemModel(BaseModel):
+    id: int
+    status: str
+
+
+class BatchResultModel(BaseModel):
+    results: List[BatchResultItemModel]
 
 
 class PrivateUpdateUserModel(BaseModel):
@@ -0,0 +1,4 @@
+from .cities import CityRegistry
+from .lru import LRUCache
+from .principal import PrincipalCache
+from .response import CachedResponse, ResponseCache
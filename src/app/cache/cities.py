@@ -0,0 +1,79 @@
+from hashlib import sha1
+from time import monotonic
+
+from app.abs import IDi
+from app.db import statements
+
+
+class CityRegistry(IDi):
+    """In-memory copy of the ``city`` table shared by every request of a worker.
+
+    Writes bump the ``cities`` row of ``counters`` in the same transaction;
+    each worker compares that version with its own at most once per
+    ``check_interval`` seconds and reloads the table when it moved.
+    """
+
+    name = 'cities'
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('city_cache', {})
+        self._interval = float(config.get('check_interval', 5))
+        self._cities = []
+        self._by_id = {}
+        self._version = None
+        self._etag = None
+        self._checked = 0.0
+        self.checks = 0
+        self.reloads = 0
+
+    async def load(self):
+        # one snapshot: the list and the version never come from different replicas or commits
+        rows, version = await self._di.db.snapshot(
+            (statements.city_list, None),
+            (statements.counter_value, {'name': self.name}),
+        )
+        self._version = (version[0]['value'] if version else None) or 0
+        self._cities = rows
+        self._by_id = {city['id']: city for city in self._cities}
+        self._etag = '"{}"'.format(sha1(repr([tuple(c.values()) for c in self._cities]).encode()).hexdigest()[:16])
+        self._checked = monotonic()
+        self.reloads += 1
+
+    async def __refresh(self):
+        now = monotonic()
+        if self._version is not None and now < self._checked + self._interval:
+            return
+        self.checks += 1
+        if self._version is None or await self.__db_version() != self._version:
+            await self.load()
+        else:
+            self._checked = now
+
+    async def __db_version(self):
+        return await self._di.db.val(statements.counter_value, {'name': self.name}) or 0
+
+    async def all(self):
+        await self.__refresh()
+        return self._cities, self._etag
+
+    async def get(self, pk):
+        await self.__refresh()
+        return self._by_id.get(pk)
+
+    async def changed(self):
+        await self._di.db.exec(statements.counter_bump, {'name': self.name})
+        # a reload before the commit would still see the old list and keep it for check_interval
+        self._di.db.on_commit(self.__reset)
+
+    def __reset(self):
+        self._version = None
+
+    def stats(self):
+        return {
+            'size': len(self._cities),
+            'version': self._version,
+            'etag': self._etag,
+            'checks': self.checks,
+            'reloads': self.reloads,
+        }
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCache(object):
+    """Bounded mapping with least-recently-used eviction and a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl) -> None:
+        super().__init__()
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None:
+            value, expires = item
+            if monotonic() < expires:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+            self.evictions += 1
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        expires = monotonic() + (self._ttl if ttl is None else ttl)
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return None if item is None else item[0]
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self._maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
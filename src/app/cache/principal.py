@@ -0,0 +1,48 @@
+from app.abs import IDi
+from app.db import statements
+
+from .lru import LRUCache
+
+
+class PrincipalCache(IDi):
+    """Authenticated principals ``{id, email, is_admin}`` keyed by email, with an ``id -> email`` index.
+
+    Invalidation reaches only this worker: other workers see a change after
+    ``ttl``. Admins are therefore never cached, so a demoted or deleted admin
+    loses access in every worker at once; a changed or deleted ordinary user
+    may stay authenticated elsewhere for up to ``ttl`` seconds.
+    """
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('principal_cache', {})
+        self._maxsize = int(config.get('maxsize', 10000))
+        self._cache = LRUCache(self._maxsize, float(config.get('ttl', 60)))
+        self._emails = {}
+
+    async def get(self, email):
+        principal = self._cache.get(email)
+        if principal is None:
+            principal = await self._di.db.row(statements.principal_by_email, {'email': email})
+            if principal is None or principal['is_admin']:
+                return principal
+            self._cache.set(email, principal)
+            self._emails[principal['id']] = email
+            if len(self._emails) > 2 * self._maxsize:
+                # ids of principals evicted from the LRU, dropped in one pass now and then
+                self._emails = {principal['id']: email for email, principal in self._cache.items()}
+        return principal
+
+    def invalidate(self, email):
+        self._di.db.on_commit(lambda: self._cache.pop(email))
+
+    def invalidate_id(self, pk):
+        self._di.db.on_commit(lambda: self.__drop(pk))
+
+    def __drop(self, pk):
+        email = self._emails.pop(pk, None)
+        if email is not None:
+            self._cache.pop(email)
+
+    def stats(self):
+        return self._cache.stats()
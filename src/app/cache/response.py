@@ -0,0 +1,70 @@
+from collections import namedtuple
+from time import monotonic
+
+from app.abs import IDi
+
+from .lru import LRUCache
+
+CachedResponse = namedtuple('CachedResponse', 'body etag last_modified')
+
+
+class ResponseCache(IDi):
+    """Serialized GET responses keyed by route, principal, query and paging headers.
+
+    Entries carry tags (``users``, ``user:<id>``, ``cities``). ``invalidate``
+    bumps the tags once the request transaction commits, and an entry built
+    before the bump of any of its tags is treated as a miss. The cache is per
+    worker: writes made through another worker are seen after at most ``ttl``.
+    """
+
+    VARY = ('Page', 'Size', 'Cursor', 'Hint-If-None-Match')
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('response_cache', {})
+        self._ttl = float(config.get('ttl', 5))
+        self._maxsize = int(config.get('maxsize', 10000))
+        self._cache = LRUCache(self._maxsize, self._ttl)
+        self._tags = {}
+        self._clock = 0
+        self.invalidations = 0
+
+    def key(self, request, principal):
+        return (request.route.name, principal, request.query_string) + tuple(
+            request.headers.get(name) for name in self.VARY
+        )
+
+    def stamp(self):
+        return self._clock
+
+    def get(self, key):
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        response, stamp, tags = item
+        for tag in tags + ('*',):
+            if self._tags.get(tag, (0,))[0] > stamp:
+                self._cache.pop(key)
+                return None
+        return response
+
+    def set(self, key, stamp, tags, response):
+        if self._ttl > 0:
+            self._cache.set(key, (response, stamp, tuple(tags)))
+        return response
+
+    def invalidate(self, *tags):
+        self._di.db.on_commit(lambda: self.__bump(tags))
+
+    def __bump(self, tags):
+        self._clock += 1
+        self.invalidations += 1
+        now = monotonic()
+        for tag in tags:
+            self._tags[tag] = (self._clock, now)
+        if len(self._tags) > self._maxsize:
+            # entries older than ttl are gone anyway, so are the tags bumped before them
+            self._tags = {tag: value for tag, value in self._tags.items() if value[1] > now - self._ttl}
+
+    def stats(self):
+        return {**self._cache.stats(), 'invalidations': self.invalidations}
@@ -1 +1,2 @@
 from .db import Db
+from .migrate import Migrator
@@ -1,15 +1,26 @@
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
 from inspect import isawaitable
+from time import perf_counter
 
 from sanic import exceptions
-from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.future import select
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text as text_
 
 from app.abs import IDi
 
+from .migrations import SCHEMA_VERSION
+from .query_log import QueryLog
+from .replicas import REPLICA_ERRORS, Replicas, readable
+
+logger = logging.getLogger(__name__)
+
 
 def error_handling(fn):
     @wraps(fn)
@@ -33,11 +44,174 @@ class Db(IDi):
 
     Base = declarative_base()
 
+    _scope = ContextVar('db_scope', default=None)
+    _queries = ContextVar('db_queries', default=None)
+
+    START_LOCK_KEY = 0x4B656669
+
     def __init__(self, di, db_url=None) -> None:
         super().__init__(di)
         self._db_url = self.build_connection_string() if db_url is None else db_url
-        self.__engine = create_async_engine(self._db_url, echo=True)
-        self.__session = sessionmaker(self.__engine, expire_on_commit=False, class_=AsyncSession)
+        self.__engine = None
+        self.__session = None
+        self.__replicas = None
+        self.primary_reads = 0
+        self.query_log = QueryLog(di.config.get('logging', {}))
+        self.__wait_count = 0
+        self.__wait_total = 0.0
+        self.__wait_max = 0.0
+
+    def pool_options(self):
+        config = self._di.config['db']
+        return {
+            'pool_size': int(config.get('pool_size', 5)),
+            'max_overflow': int(config.get('max_overflow', 10)),
+            'pool_recycle': int(config.get('pool_recycle', -1)),
+            'pool_pre_ping': bool(config.get('pool_pre_ping', False)),
+            'pool_timeout': float(config.get('pool_timeout', 30)),
+        }
+
+    def cache_options(self):
+        """Sizes of the compiled statement cache and of the per-connection asyncpg prepared statement cache."""
+        config = self._di.config['db']
+        return {
+            'query_cache_size': int(config.get('query_cache_size', 500)),
+            'connect_args': {'prepared_statement_cache_size': int(config.get('prepared_statement_cache_size', 100))},
+        }
+
+    def replica_urls(self):
+        """``db_replicas`` (comma separated, from the environment) or the ``db.replicas`` list."""
+        urls = self._di.config.get('db_replicas')
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(',') if url.strip()]
+        if not urls:
+            urls = self._di.config['db'].get('replicas') or []
+        return [url.strip() for url in urls if url and url.strip()]
+
+    async def connect(self, replicas=True):
+        if self.__engine is None:
+            self.__engine = create_async_engine(self._db_url, **self.pool_options(), **self.cache_options())
+            self.query_log.attach(self.__engine)
+            self.__session = sessionmaker(self.__engine, expire_on_commit=False, class_=AsyncSession)
+            urls = self.replica_urls() if replicas else []
+            if urls:
+                self.__replicas = Replicas(urls, self._di.config['db'], {**self.pool_options(), **self.cache_options()})
+                for replica in self.__replicas.replicas:
+                    self.query_log.attach(replica.engine)
+                await self.__replicas.start()
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    async def disconnect(self):
+        if self.__replicas is not None:
+            await self.__replicas.stop()
+            self.__replicas = None
+        if self.__engine is not None:
+            await self.__engine.dispose()
+            self.__engine = None
+            self.__session = None
+
+    def pool_status(self):
+        if self.__engine is None:
+            return None
+        pool = self.__engine.pool
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'wait': {
+                'count': self.__wait_count,
+                'total_ms': round(self.__wait_total * 1000, 3),
+                'avg_ms': round(self.__wait_total * 1000 / self.__wait_count, 3) if self.__wait_count else 0.0,
+                'max_ms': round(self.__wait_max * 1000, 3),
+            },
+        }
+
+    def replica_status(self):
+        if self.__replicas is None:
+            return None
+        return {**self.__replicas.stats(), 'primary_reads': self.primary_reads}
+
+    def begin_scope(self):
+        session = self.__session()
+        token = self._scope.set(session)
+        return session, token
+
+    async def end_scope(self, session, token, commit=True):
+        callbacks = session.sync_session.info.pop('on_commit', ())
+        try:
+            if commit:
+                await session.commit()
+            else:
+                await session.rollback()
+                callbacks = ()
+        finally:
+            await session.close()
+            self._scope.reset(token)
+        for callback in callbacks:
+            callback()
+
+    async def commit_scope(self):
+        session = self._scope.get()
+        if session is not None:
+            await session.commit()
+            for callback in session.sync_session.info.pop('on_commit', ()):
+                callback()
+
+    def count_queries(self):
+        """Starts counting the statements executed by the current request (task)."""
+        self._queries.set([0])
+
+    def counted_queries(self):
+        counter = self._queries.get()
+        return None if counter is None else counter[0]
+
+    def __count(self):
+        counter = self._queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def on_commit(self, callback):
+        """Runs ``callback`` once the request transaction commits, or right away outside of one."""
+        session = self._scope.get()
+        if session is None:
+            callback()
+        else:
+            session.sync_session.info.setdefault('on_commit', []).append(callback)
+
+    @asynccontextmanager
+    async def scope(self):
+        session, token = self.begin_scope()
+        try:
+            yield session
+        except BaseException:
+            await self.end_scope(session, token, commit=False)
+            raise
+        await self.end_scope(session, token)
+
+    @asynccontextmanager
+    async def savepoint(self):
+        """``SAVEPOINT`` in the request transaction: an error inside rolls back only the block."""
+        session = self._scope.get()
+        await self.__acquire(session)
+        async with session.begin_nested():
+            yield
+
+    async def __acquire(self, session):
+        info = session.sync_session.info
+        if info.get('acquired'):
+            return
+        start = perf_counter()
+        await session.connection()
+        wait = perf_counter() - start
+        info['acquired'] = True
+        self.__wait_count += 1
+        self.__wait_total += wait
+        if wait > self.__wait_max:
+            self.__wait_max = wait
 
     def build_connection_string(self):
         return '{}://{}:{}@{}:{}/{}'.format(
@@ -49,28 +223,44 @@ class Db(IDi):
             self._di.config['db']['db_name'],
         )
 
+    async def schema_version(self):
+        try:
+            return await self.val(text_('SELECT max(version) FROM schema_version'))
+        except ProgrammingError:
+            return None
+
     @error_handling
     async def db_start(self, sql, first_admin):
-        async with self.__engine.begin() as conn:
-            await conn.run_sync(self.Base.metadata.create_all)
-        admin_check = await self.val(sql)
-        if not admin_check:
-            await self.add_user(first_admin)
-        await self.__engine.dispose()
+        await self.connect(replicas=False)
+        try:
+            version = await self.schema_version()
+            if version != SCHEMA_VERSION:
+                raise RuntimeError(
+                    f'database schema version is {version}, expected {SCHEMA_VERSION}: '
+                    'run "python start.py migrate"'
+                )
+            async with self.__engine.connect() as lock:
+                await lock.execute(text_('SELECT pg_advisory_lock(:key)'), {'key': self.START_LOCK_KEY})
+                try:
+                    admin_check = await self.val(sql)
+                    if not admin_check:
+                        await self.add_user(first_admin)
+                finally:
+                    await lock.execute(text_('SELECT pg_advisory_unlock(:key)'), {'key': self.START_LOCK_KEY})
+        finally:
+            await self.disconnect()
 
     @error_handling
     async def exec(self, sql, data=None):
         try:
             response = await self.__execute_query(sql, data)
-            if response.is_insert:
+            if response.is_insert and response.inserted_primary_key:
                 result = response.inserted_primary_key[0]
             else:
                 result = None
         except IntegrityError as e:
-            print(e)
+            logger.warning('integrity error: %s', e.orig)
             result = None
-        finally:
-            await self.__engine.dispose()
 
         return result
 
@@ -78,34 +268,132 @@ class Db(IDi):
     async def __execute_query(self, sql, data=None, page=0, page_size=None):
         if data is None:
             data = {}
+        if page:
+            start = (page - 1) * page_size
+            sql = sql.limit(page_size).offset(start)
+        self.__count()
+        replica = self.__pick(sql)
+        if replica is not None:
+            result = await self.__read_replica(replica, sql, data)
+            if result is not None:
+                return result
         try:
-            async with self.__session() as session:
-                async with session.begin():
-                    if page:
-                        start = (page - 1) * page_size
-                        sql = sql.limit(page_size).offset(start)
+            session = self._scope.get()
+            if session is not None:
+                await self.__acquire(session)
+                result = await session.execute(sql, data)
+            else:
+                async with self.__session() as session:
+                    async with session.begin():
+                        await self.__acquire(session)
                         result = await session.execute(sql, data)
-                        return result
-                    result = await session.execute(sql, data)
-        except OperationalError as e:
-            print(e)
+        except OperationalError:
+            logger.exception('database is unavailable')
+            raise exceptions.ServiceUnavailable('db unavailable')
 
         return result
 
+    def __pick(self, sql):
+        """The replica for ``sql``: selects only, and only until the request scope used the primary."""
+        if self.__replicas is None or not readable(sql):
+            return None
+        session = self._scope.get()
+        if session is not None and session.sync_session.info.get('acquired'):
+            self.primary_reads += 1
+            return None
+        replica = self.__replicas.pick()
+        if replica is None:
+            self.primary_reads += 1
+        return replica
+
+    async def __read_replica(self, replica, sql, data):
+        replica.in_flight += 1
+        try:
+            async with replica.engine.connect() as conn:
+                result = await conn.execute(sql, data)
+        except REPLICA_ERRORS as e:
+            self.__replicas.failed(replica, e)
+            self.primary_reads += 1
+            return None
+        finally:
+            replica.in_flight -= 1
+        replica.reads += 1
+        return result
+
     @error_handling
     async def add_user(self, user):
         from app.model.tables import User
 
+        async with self.scope() as session:
+            sql = select(User.__table__.c.email).where(User.email == user.email)
+            user_check = await self.val(sql)
+            if not user_check:
+                session.add(user)
+                return user
+
+    async def stream(self, sql, data=None, chunk_size=1000):
+        self.__count()
+        replica = self.__pick(sql)
+        if replica is not None:
+            # no fallback to the primary once rows have been sent
+            replica.in_flight += 1
+            try:
+                async with replica.engine.connect() as conn:
+                    result = await conn.stream(sql, data or {})
+                    async for partition in result.partitions(chunk_size):
+                        yield [row._mapping for row in partition]
+                replica.reads += 1
+                return
+            except REPLICA_ERRORS as e:
+                self.__replicas.failed(replica, e)
+                raise
+            finally:
+                replica.in_flight -= 1
         async with self.__session() as session:
             async with session.begin():
-                sql = select(User.__table__.c.email).where(User.email == user.email)
-                user_check = await self.val(sql)
-                if not user_check:
-                    session.add(user)
-                    return user
-                await session.commit()
+                result = await session.stream(sql, data or {})
+                async for partition in result.partitions(chunk_size):
+                    yield [row._mapping for row in partition]
+
+    @error_handling
+    async def snapshot(self, *queries):
+        """Rows of every ``(sql, data)`` query, read on one connection in one ``REPEATABLE READ`` transaction.
 
-        await self.__engine.dispose()
+        The queries see the same state of the database even when replicas are
+        configured; inside a request that already used the primary they run in
+        its transaction.
+        """
+        for _ in queries:
+            self.__count()
+        session = self._scope.get()
+        if session is not None and session.sync_session.info.get('acquired'):
+            self.primary_reads += 1
+            return [[dict(row._mapping) for row in await session.execute(sql, data or {})] for sql, data in queries]
+        replica = self.__pick(queries[0][0])
+        if replica is not None:
+            replica.in_flight += 1
+            try:
+                async with replica.engine.connect() as conn:
+                    result = await self.__read_snapshot(conn, queries)
+                replica.reads += 1
+                return result
+            except REPLICA_ERRORS as e:
+                self.__replicas.failed(replica, e)
+                self.primary_reads += 1
+            finally:
+                replica.in_flight -= 1
+        try:
+            async with self.__engine.connect() as conn:
+                return await self.__read_snapshot(conn, queries)
+        except OperationalError:
+            logger.exception('database is unavailable')
+            raise exceptions.ServiceUnavailable('db unavailable')
+
+    @staticmethod
+    async def __read_snapshot(conn, queries):
+        conn = await conn.execution_options(isolation_level='REPEATABLE READ')
+        async with conn.begin():
+            return [[dict(row._mapping) for row in await conn.execute(sql, data or {})] for sql, data in queries]
 
     @error_handling
     async def val(self, sql, data=None):
@@ -114,7 +402,6 @@ class Db(IDi):
         if row is None:
             return None
         result = row[0]
-        await self.__engine.dispose()
         return result
 
     @error_handling
@@ -122,10 +409,8 @@ class Db(IDi):
         rows = await self.__execute_query(sql, data=data)
         row = rows.fetchone()
         if row is None:
-            await self.__engine.dispose()
             return None
         result = {column: value for column, value in row._mapping.items()}
-        await self.__engine.dispose()
         return result
 
     @error_handling
@@ -134,7 +419,6 @@ class Db(IDi):
             sql, data=data, page=page, page_size=page_size
         )
         result = [row._mapping.items() for row in rows]
-        await self.__engine.dispose()
         return result
 
     @error_handling
@@ -144,5 +428,4 @@ class Db(IDi):
             result = response.inserted_primary_key
         else:
             result = response.context.compiled_parameters
-        await self.__engine.dispose()
         return result
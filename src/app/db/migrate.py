@@ -0,0 +1,76 @@
+import logging
+
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.sql import text as text_
+
+from app.abs import IDi
+
+from .migrations import MIGRATIONS, SCHEMA_VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class Migrator(IDi):
+    """Applies ``app.db.migrations`` in version order.
+
+    Runs from the ``migrate`` command, never from the web server. Every
+    applied migration is recorded in ``schema_version``; migrations marked
+    non-transactional run on an AUTOCOMMIT connection so they can use
+    ``CREATE INDEX CONCURRENTLY``.
+    """
+
+    version_table_sql = text_(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR NOT NULL, '
+        'applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())'
+    )
+    current_sql = text_('SELECT max(version) FROM schema_version')
+    record_sql = text_('INSERT INTO schema_version (version, description) VALUES (:version, :description)')
+
+    async def status(self):
+        db = self._di.db
+        await db.connect(replicas=False)
+        try:
+            async with db.engine.connect() as conn:
+                try:
+                    current = (await conn.execute(self.current_sql)).scalar()
+                except ProgrammingError:
+                    current = None
+        finally:
+            await db.disconnect()
+        pending = [m for m in MIGRATIONS if m.version > (current or 0)]
+        return current, SCHEMA_VERSION, pending
+
+    async def upgrade(self):
+        db = self._di.db
+        await db.connect(replicas=False)
+        try:
+            async with db.engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                await conn.execute(text_('SELECT pg_advisory_lock(:key)'), {'key': db.START_LOCK_KEY})
+                try:
+                    await conn.execute(self.version_table_sql)
+                    current = (await conn.execute(self.current_sql)).scalar() or 0
+                    applied = []
+                    for migration in MIGRATIONS:
+                        if migration.version <= current:
+                            continue
+                        logger.info('applying migration %04d: %s', migration.version, migration.description)
+                        if migration.transactional:
+                            async with db.engine.begin() as tx:
+                                await migration.upgrade(tx)
+                                await tx.execute(self.record_sql, self.__record(migration))
+                        else:
+                            await migration.upgrade(conn)
+                            await conn.execute(self.record_sql, self.__record(migration))
+                        applied.append(migration.version)
+                finally:
+                    await conn.execute(text_('SELECT pg_advisory_unlock(:key)'), {'key': db.START_LOCK_KEY})
+        finally:
+            await db.disconnect()
+        return applied
+
+    @staticmethod
+    def __record(migration):
+        return {'version': migration.version, 'description': migration.description}
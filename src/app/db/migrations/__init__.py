@@ -0,0 +1,12 @@
+from . import (m0001_initial, m0002_user_indexes, m0003_user_search,
+               m0004_user_version, m0005_user_name_keyset)
+
+MIGRATIONS = (
+    m0001_initial,
+    m0002_user_indexes,
+    m0003_user_search,
+    m0004_user_version,
+    m0005_user_name_keyset,
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
@@ -0,0 +1,40 @@
+from sqlalchemy.sql import text as text_
+
+version = 1
+description = 'city, users and counters tables'
+transactional = True
+
+STATEMENTS = (
+    '''CREATE TABLE IF NOT EXISTS city (
+        id SERIAL NOT NULL,
+        name VARCHAR,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS counters (
+        name VARCHAR NOT NULL,
+        value BIGINT NOT NULL,
+        PRIMARY KEY (name)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS users (
+        id SERIAL NOT NULL,
+        first_name VARCHAR,
+        last_name VARCHAR,
+        other_name VARCHAR,
+        email VARCHAR,
+        phone VARCHAR,
+        birthday DATE,
+        city INTEGER,
+        additional_info VARCHAR,
+        is_admin BOOLEAN,
+        password_hash VARCHAR,
+        PRIMARY KEY (id),
+        UNIQUE (email),
+        FOREIGN KEY(city) REFERENCES city (id)
+    )''',
+)
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text_(statement))
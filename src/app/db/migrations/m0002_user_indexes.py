@@ -0,0 +1,20 @@
+from .ops import create_index
+
+version = 2
+description = 'users list, sort and filter indexes'
+transactional = False
+
+INDEXES = (
+    ('ix_users_city', 'users (city)'),
+    ('ix_users_last_name_first_name_id', 'users (last_name, first_name, id)'),
+    ('ix_users_is_admin', 'users (is_admin)'),
+    ('ix_users_birthday', 'users (birthday)'),
+    ('ix_users_last_name_pattern', 'users (last_name varchar_pattern_ops)'),
+    ('ix_users_first_name_pattern', 'users (first_name varchar_pattern_ops)'),
+    ('ix_users_email_pattern', 'users (email varchar_pattern_ops)'),
+)
+
+
+async def upgrade(conn):
+    for name, definition in INDEXES:
+        await create_index(conn, name, definition)
@@ -0,0 +1,18 @@
+from sqlalchemy.sql import text as text_
+
+from .ops import create_index
+
+version = 3
+description = 'pg_trgm indexes for users substring search'
+transactional = False
+
+INDEXES = (
+    ('ix_users_last_name_trgm', 'users USING gin (last_name gin_trgm_ops)'),
+    ('ix_users_first_name_trgm', 'users USING gin (first_name gin_trgm_ops)'),
+)
+
+
+async def upgrade(conn):
+    await conn.execute(text_('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for name, definition in INDEXES:
+        await create_index(conn, name, definition)
@@ -0,0 +1,15 @@
+from sqlalchemy.sql import text as text_
+
+version = 4
+description = 'users row version and updated_at'
+transactional = True
+
+STATEMENTS = (
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1',
+    'ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()',
+)
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text_(statement))
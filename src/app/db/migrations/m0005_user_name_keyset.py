@@ -0,0 +1,17 @@
+from sqlalchemy.sql import text as text_
+
+from .ops import create_index
+
+version = 5
+description = 'users name sort index on coalesced names'
+transactional = False
+
+INDEXES = (
+    ('ix_users_name_keyset', "users (coalesce(last_name, ''), coalesce(first_name, ''), id)"),
+)
+
+
+async def upgrade(conn):
+    for name, definition in INDEXES:
+        await create_index(conn, name, definition)
+    await conn.execute(text_('DROP INDEX CONCURRENTLY IF EXISTS ix_users_last_name_first_name_id'))
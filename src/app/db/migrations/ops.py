@@ -0,0 +1,19 @@
+from sqlalchemy.sql import text as text_
+
+INVALID_INDEX_SQL = text_(
+    'SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+    'WHERE c.relname = :name'
+)
+
+
+async def create_index(conn, name, definition):
+    """``CREATE INDEX CONCURRENTLY`` that can be re-run after a failure.
+
+    A failed concurrent build leaves an INVALID index behind which
+    ``IF NOT EXISTS`` would silently keep, so it is dropped first.
+    Must run on an AUTOCOMMIT connection.
+    """
+    invalid = (await conn.execute(INVALID_INDEX_SQL, {'name': name})).scalar()
+    if invalid:
+        await conn.execute(text_(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    await conn.execute(text_(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}'))
@@ -0,0 +1,75 @@
+import logging
+import random
+from time import perf_counter
+
+from sqlalchemy import event
+
+logger = logging.getLogger('app.db.query')
+
+
+class QueryLog(object):
+    """Sampled statement log with an always-on slow query threshold.
+
+    Replaces the engine ``echo`` flag: statements are never formatted unless
+    they are sampled or slower than ``slow_query_ms``, and bound parameters
+    are never written to the log.
+
+    Also counts executions per ``statement_name`` execution option (see
+    ``app.db.statements``; anything else is ``adhoc``) with the hits of the
+    SQLAlchemy compiled cache. Hits of the asyncpg prepared statement cache
+    are not counted: they are only visible through adapter internals.
+    Durations also go to ``histogram`` (a metric labeled by statement name)
+    when one is set.
+    """
+
+    def __init__(self, config) -> None:
+        super().__init__()
+        self.sample_rate = float(config.get('sample_rate', 0.0))
+        self.slow_query_ms = float(config.get('slow_query_ms', 200))
+        logger.setLevel(config.get('query_level', 'INFO'))
+        self._statements = {}
+        self.histogram = None
+
+    def attach(self, engine):
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine.sync_engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_start = perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = (perf_counter() - context._query_start) * 1000
+        name = context.execution_options.get('statement_name', 'adhoc')
+        counters = self._statements.get(name)
+        if counters is None:
+            counters = self._statements[name] = [
+                0, 0, 0.0, None if self.histogram is None else self.histogram.labels(name)]
+        counters[0] += 1
+        counters[1] += context.cache_hit is conn.dialect.CACHE_HIT
+        counters[2] += duration
+        if counters[3] is not None:
+            counters[3].observe(duration / 1000)
+        if duration >= self.slow_query_ms:
+            logger.warning('slow query %.2f ms: %s', duration, statement)
+        elif self.sample_rate and random.random() < self.sample_rate:
+            logger.info('query %.2f ms: %s', duration, statement)
+
+    def stats(self):
+        def rate(hits, count):
+            return round(hits / count, 4) if count else 0.0
+
+        totals = [0, 0]
+        statements = {}
+        for name, (count, compiled, total_ms, _) in sorted(self._statements.items()):
+            totals[0] += count
+            totals[1] += compiled
+            statements[name] = {
+                'count': count,
+                'compiled_hit_rate': rate(compiled, count),
+                'avg_ms': round(total_ms / count, 3),
+            }
+        return {
+            'count': totals[0],
+            'compiled_hit_rate': rate(totals[1], totals[0]),
+            'statements': statements,
+        }
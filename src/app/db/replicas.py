@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql import text as text_
+
+logger = logging.getLogger(__name__)
+
+# connection level failures: the replica is marked down and the read goes to the primary
+REPLICA_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+LAG_SQL = text_('''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+''')
+
+
+def readable(sql):
+    """Plain SELECT constructs may go to a replica; text(), writes and SELECT ... FOR UPDATE may not."""
+    return getattr(sql, 'is_select', False) and getattr(sql, '_for_update_arg', None) is None
+
+
+class Replica(object):
+
+    def __init__(self, url, engine) -> None:
+        super().__init__()
+        self.url = url
+        self.engine = engine
+        self.name = '{}:{}/{}'.format(engine.url.host, engine.url.port or 5432, engine.url.database)
+        self.healthy = False
+        self.lag = None
+        self.in_flight = 0
+        self.reads = 0
+        self.errors = 0
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'healthy': self.healthy,
+            'lag': self.lag,
+            'in_flight': self.in_flight,
+            'reads': self.reads,
+            'errors': self.errors,
+        }
+
+
+class Replicas(object):
+    """Read replicas of one worker: balancing, health and lag checks.
+
+    Every ``check_interval`` seconds each replica reports its replay lag; a
+    replica that fails the check, lags more than ``max_lag`` seconds or
+    fails a read with a connection error gets no reads until the next
+    successful check. ``pick()`` returns ``None`` when no replica is usable
+    and the caller reads from the primary.
+    """
+
+    BALANCING = ('round_robin', 'least_connections')
+
+    def __init__(self, urls, config, engine_options) -> None:
+        super().__init__()
+        self.balance = config.get('replica_balance', 'round_robin')
+        if self.balance not in self.BALANCING:
+            raise ValueError('db.replica_balance must be one of {}'.format(', '.join(self.BALANCING)))
+        self.max_lag = float(config.get('replica_max_lag', 5))
+        self.check_interval = float(config.get('replica_check_interval', 2))
+        self.check_timeout = float(config.get('replica_check_timeout', 1))
+        self.replicas = [Replica(url, create_async_engine(url, **engine_options)) for url in urls]
+        self._next = 0
+        self._task = None
+        self.fallbacks = 0
+
+    async def start(self):
+        await self.check()
+        self._task = asyncio.get_running_loop().create_task(self.__check_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def check(self):
+        await asyncio.gather(*(self.__check(replica) for replica in self.replicas))
+
+    async def __check(self, replica):
+        try:
+            lag = await asyncio.wait_for(self.__lag(replica), self.check_timeout)
+        except REPLICA_ERRORS as e:
+            if replica.healthy:
+                logger.warning('replica %s is down: %s', replica.name, e)
+            replica.healthy = False
+            return
+        replica.lag = float(lag or 0)
+        healthy = replica.lag <= self.max_lag
+        if healthy != replica.healthy:
+            logger.warning('replica %s is %s (lag %.3f s)', replica.name, 'up' if healthy else 'lagging', replica.lag)
+        replica.healthy = healthy
+
+    @staticmethod
+    async def __lag(replica):
+        async with replica.engine.connect() as conn:
+            return await conn.scalar(LAG_SQL)
+
+    async def __check_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception('replica check failed')
+
+    def pick(self):
+        candidates = [replica for replica in self.replicas if replica.healthy]
+        if not candidates:
+            self.fallbacks += 1
+            return None
+        if self.balance == 'least_connections':
+            return min(candidates, key=lambda replica: replica.in_flight)
+        self._next += 1
+        return candidates[self._next % len(candidates)]
+
+    def failed(self, replica, error):
+        replica.errors += 1
+        if replica.healthy:
+            logger.warning('replica %s failed a read, reading from the primary: %s', replica.name, error)
+        replica.healthy = False
+
+    def stats(self):
+        return {
+            'balance': self.balance,
+            'max_lag': self.max_lag,
+            'fallbacks': self.fallbacks,
+            'replicas': [replica.stats() for replica in self.replicas],
+        }
@@ -0,0 +1,88 @@
+"""Named statements of the hot paths, built once at import.
+
+Handlers execute them with bound parameters instead of building a construct
+per request, so SQLAlchemy finds the compiled form by the memoized cache key
+and asyncpg finds the server-side prepared statement in the per-connection
+cache (``db.prepared_statement_cache_size``). The name travels in the
+``statement_name`` execution option and keys the statistics of ``QueryLog``.
+"""
+from sqlalchemy import bindparam
+from sqlalchemy.future import select
+from sqlalchemy.sql import delete, func, insert
+from sqlalchemy.sql import text as text_
+from sqlalchemy.sql import update
+
+from app.model.tables import City, Counter, User
+
+STATEMENTS = {}
+
+
+def named(name, sql):
+    if name in STATEMENTS:
+        raise ValueError('statement {!r} is already registered'.format(name))
+    sql = sql.execution_options(statement_name=name)
+    STATEMENTS[name] = sql
+    return sql
+
+
+users = User.__table__
+cities = City.__table__
+counters = Counter.__table__
+
+# users
+user_by_email = named('user_by_email', select(users).where(users.c.email == bindparam('email')))
+user_insert = named('user_insert', insert(users))
+user_by_id = named('user_by_id', select(users).where(users.c.id == bindparam('pk')))
+user_set_password = named('user_set_password', update(users).where(users.c.id == bindparam('pk')).values(
+    password_hash=bindparam('password_hash')))
+principal_by_email = named('principal_by_email', select(users.c.id, users.c.email, users.c.is_admin).where(
+    users.c.email == bindparam('email')))
+current_user = named('current_user', select(
+    users.c.first_name,
+    users.c.last_name,
+    users.c.email,
+    users.c.is_admin,
+    users.c.other_name,
+    users.c.phone,
+    users.c.birthday,
+    users.c.version,
+    users.c.updated_at
+).where(users.c.id == bindparam('pk')))
+user_lock = named('user_lock', select(users.c.id).where(users.c.id == bindparam('pk')).with_for_update())
+user_update_self = named('user_update_self', text_('''
+    UPDATE users SET
+    first_name = :first_name,
+    last_name = :last_name,
+    email = :email,
+    other_name = :other_name,
+    phone = :phone,
+    birthday = :birthday,
+    version = version + 1,
+    updated_at = now()
+    WHERE
+    id = :id
+'''))
+# SET takes the columns present in the parameters
+user_update = named('user_update', update(users).where(users.c.id == bindparam('pk')).values(
+    version=users.c.version + 1, updated_at=func.now()))
+user_delete = named('user_delete', delete(users).where(users.c.id == bindparam('pk')).returning(users.c.id))
+user_in_city = named('user_in_city', select(users.c.id).where(users.c.city == bindparam('city')).limit(1))
+users_count = named('users_count', select(func.count(users.c.id)))
+
+# cities
+city_list = named('city_list', select(cities.c.id, cities.c.name).order_by(cities.c.id))
+# the postgresql insert() with ON CONFLICT is not cacheable in this SQLAlchemy, text() is
+city_insert = named('city_insert', text_(
+    'INSERT INTO city (name) VALUES (:name) ON CONFLICT (name) DO NOTHING RETURNING id'))
+city_rename = named('city_rename', update(cities).where(cities.c.id == bindparam('pk')).values(
+    name=bindparam('name')).returning(cities.c.id))
+city_delete = named('city_delete', delete(cities).where(cities.c.id == bindparam('pk')).returning(cities.c.id))
+
+# counters
+counter_value = named('counter_value', select(counters.c.value).where(counters.c.name == bindparam('name')))
+counter_init = named('counter_init', text_(
+    'INSERT INTO counters (name, value) VALUES (:name, :value) ON CONFLICT (name) DO NOTHING'))
+# update() reserves the bind name of the "name" column for its SET clause
+counter_add = named('counter_add', text_('UPDATE counters SET value = value + :delta WHERE name = :name'))
+counter_bump = named('counter_bump', text_(
+    'INSERT INTO counters (name, value) VALUES (:name, 1) ON CONFLICT (name) DO UPDATE SET value = counters.value + 1'))
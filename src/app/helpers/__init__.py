@@ -1,5 +1,19 @@
+from .admission import Admission, admission_control
+from .batch import batch_delete, batch_update
+from .bulk_import import UserImport
 from .check_admin import check_admin
-from .json_serializer import json_serial
+from .conditional import (cached_json, conditional_response, make_etag,
+                          not_modified, not_modified_response)
+from .json_serializer import json_dumps
 from .list_of_users import users_list
+from .log_queue import LogQueue
+from .password_hasher import PasswordHasher
+from .profiler import Profiler
 from .request_validation import request_validation
+from .response import json_response
+from .serializer import Serializer
 from .str_to_date import find_date
+from .unit_of_work import unit_of_work
+from .user_export import export_users
+from .user_filter import user_filters
+from .users_count import users_count
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+from collections import deque
+from functools import wraps
+from inspect import isawaitable
+from math import ceil
+from time import monotonic
+
+from app.abs import IDi
+from app.cache import LRUCache
+
+from .response import json_response
+
+logger = logging.getLogger(__name__)
+
+
+def rejected(message, status, retry_after):
+    """429 / 503 shaped like Sanic's JSON errors, with ``Retry-After`` (the JSON error renderer drops headers)."""
+    return json_response({'description': message, 'status': status, 'message': message}, status=status,
+                         headers={'Retry-After': str(max(1, ceil(retry_after)))})
+
+
+class TokenBuckets(object):
+    """Token bucket per key: ``burst`` requests at once, refilled at ``rate`` per second.
+
+    An idle bucket refills completely in ``burst / rate`` seconds, so keys are
+    kept that long at most and the LRU bound only drops full buckets early.
+    """
+
+    def __init__(self, rate, burst, maxsize) -> None:
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._buckets = LRUCache(int(maxsize), self.burst / self.rate)
+        self.rejected = 0
+
+    def take(self, key):
+        """0 when the request may pass, otherwise seconds until the next token."""
+        now = monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            self._buckets.set(key, (tokens - 1, now))
+            return 0
+        self._buckets.set(key, (tokens, now))
+        self.rejected += 1
+        return (1 - tokens) / self.rate
+
+    def stats(self):
+        return {'rate': self.rate, 'burst': self.burst, 'keys': len(self._buckets), 'rejected': self.rejected}
+
+
+class ConcurrencyLimit(object):
+    """At most ``limit`` requests in flight, then a FIFO queue of at most ``queue``.
+
+    A request that would wait longer than ``timeout`` (estimated from the
+    queue length and the average time in flight) is rejected at once rather
+    than after the timeout; one that is admitted to the queue gives up after
+    ``timeout``.
+    """
+
+    def __init__(self, limit, queue, timeout) -> None:
+        super().__init__()
+        self.limit = int(limit)
+        self.queue = int(queue)
+        self.timeout = float(timeout)
+        self.active = 0
+        self._waiters = deque()
+        self._service = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    def expected_wait(self):
+        return (len(self._waiters) + 1) * self._service / self.limit
+
+    async def acquire(self):
+        """``None`` when a slot is taken, otherwise the suggested retry delay in seconds."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return None
+        wait = self.expected_wait()
+        if len(self._waiters) >= self.queue or wait > self.timeout:
+            self.shed += 1
+            return max(wait, self._service)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.__forget(waiter)
+            self.shed += 1
+            return self.timeout
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the client went away
+                self.release()
+            else:
+                self.__forget(waiter)
+            raise
+        self.admitted += 1
+        return None
+
+    def release(self, duration=None):
+        if duration is not None:
+            self._service = duration if not self._service else self._service * 0.9 + duration * 0.1
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def __forget(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': len(self._waiters),
+            'avg_ms': round(self._service * 1000, 3),
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': self.shed,
+        }
+
+
+class RoutePolicy(object):
+    __slots__ = ('concurrency', 'per_ip', 'per_login')
+
+    def __init__(self, concurrency, per_ip, per_login) -> None:
+        self.concurrency = concurrency
+        self.per_ip = per_ip
+        self.per_login = per_login
+
+
+class Admission(IDi):
+    """Per-route admission policies built from the ``admission`` section of the config.
+
+    ``admission.blueprints.<blueprint>`` sets ``concurrency``, ``queue``,
+    ``queue_timeout``, ``per_ip`` and ``per_login`` ({rate, burst}) for
+    every route of the blueprint; ``routes.<handler name>`` inside it
+    overrides them for one route. Each route gets its own limiter and
+    buckets. Routes of blueprints without a section are not limited.
+    """
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('admission', {})
+        self.enabled = bool(config.get('enabled', False))
+        self._blueprints = config.get('blueprints') or {}
+        self._maxsize = int(config.get('max_keys', 100000))
+        self._policies = {}
+
+    def policy(self, route_name):
+        try:
+            return self._policies[route_name]
+        except KeyError:
+            policy = self._policies[route_name] = self.__build(route_name)
+            return policy
+
+    def __build(self, route_name):
+        if not self.enabled:
+            return None
+        parts = route_name.split('.')
+        if len(parts) < 3 or parts[1] not in self._blueprints:
+            return None
+        config = dict(self._blueprints[parts[1]] or {})
+        config.update((config.pop('routes', None) or {}).get(parts[-1]) or {})
+        concurrency = None
+        if config.get('concurrency'):
+            concurrency = ConcurrencyLimit(config['concurrency'], config.get('queue', 0),
+                                           config.get('queue_timeout', 1.0))
+        per_ip = self.__buckets(config.get('per_ip'))
+        per_login = self.__buckets(config.get('per_login'))
+        if concurrency is None and per_ip is None and per_login is None:
+            return None
+        return RoutePolicy(concurrency, per_ip, per_login)
+
+    def __buckets(self, config):
+        if not config or not config.get('rate'):
+            return None
+        return TokenBuckets(config['rate'], config.get('burst', config['rate']), self._maxsize)
+
+    def stats(self):
+        data = {}
+        for route_name, policy in self._policies.items():
+            if policy is None:
+                continue
+            data[route_name.split('.', 1)[-1]] = {
+                'concurrency': policy.concurrency.stats() if policy.concurrency is not None else None,
+                'per_ip': policy.per_ip.stats() if policy.per_ip is not None else None,
+                'per_login': policy.per_login.stats() if policy.per_login is not None else None,
+            }
+        return {'enabled': self.enabled, 'routes': data}
+
+
+def admission_control(di):
+    """Applies the route's ``Admission`` policy.
+
+    Per-IP and per-login throttling answers 429, then the concurrency limit
+    answers 503. The login is the one of the request principal, or
+    ``body.login`` on the login route. Goes right above ``unit_of_work``:
+    the body is already validated and no session is held while waiting.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def inner(request, *args, **kwargs):
+            policy = di.admission.policy(request.route.name)
+            if policy is None:
+                retval = fn(request, *args, **kwargs)
+                if isawaitable(retval):
+                    retval = await retval
+                return retval
+
+            if policy.per_ip is not None:
+                delay = policy.per_ip.take(request.remote_addr or request.ip)
+                if delay:
+                    return rejected('Too Many Requests', 429, delay)
+            if policy.per_login is not None:
+                body = kwargs.get('body')
+                login = getattr(body, 'login', None) or getattr(request.ctx, 'login', None)
+                if login is not None:
+                    delay = policy.per_login.take(str(login).lower())
+                    if delay:
+                        logger.info('login %s throttled on %s', login, request.path)
+                        return rejected('Too Many Requests', 429, delay)
+
+            limit = policy.concurrency
+            if limit is None:
+                retval = fn(request, *args, **kwargs)
+                if isawaitable(retval):
+                    retval = await retval
+                return retval
+            delay = await limit.acquire()
+            if delay is not None:
+                return rejected('Service Unavailable', 503, delay)
+            start = monotonic()
+            try:
+                retval = fn(request, *args, **kwargs)
+                if isawaitable(retval):
+                    retval = await retval
+                return retval
+            finally:
+                limit.release(monotonic() - start)
+        return inner
+    return decorator
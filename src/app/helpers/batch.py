@@ -0,0 +1,119 @@
+from sanic import exceptions
+from sqlalchemy import Integer, String, any_, bindparam
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.future import select
+from sqlalchemy.sql import delete
+from sqlalchemy.sql import text as text_
+
+from app.model.tables import City, User
+
+from .str_to_date import find_date
+from .user_filter import user_filters
+
+table = User.__table__
+
+COLUMN_TYPES = {
+    column.name: column.type.compile(dialect=postgresql.dialect())
+    for column in table.c if column.name != 'password_hash'
+}
+
+
+def batch_update_sql(columns, count):
+    """``UPDATE users ... FROM (VALUES ...)`` for ``count`` rows of ``id`` plus ``columns``."""
+    names = ['id'] + columns
+    rows = ', '.join(
+        '({})'.format(', '.join('CAST(:{}_{} AS {})'.format(name, index, COLUMN_TYPES[name]) for name in names))
+        for index in range(count)
+    )
+    sql = ('UPDATE users SET {}, version = users.version + 1, updated_at = now() '
+           'FROM (VALUES {}) AS v({}) WHERE users.id = v.id RETURNING users.id')
+    return text_(sql.format(
+        ', '.join('{0} = v.{0}'.format(name) for name in columns),
+        rows,
+        ', '.join(names),
+    ))
+
+
+FAILURES = {
+    'email already exists': 'conflict',
+    "city_id doesn't exist": 'invalid_city',
+}
+
+
+async def batch_update(di, items):
+    """Applies partial updates ``[{id, **fields}]``, one statement per distinct field set.
+
+    Returns ``{id: status}`` for every item with fields: ``updated``, ``not_found``,
+    ``conflict`` (the email belongs to another user) or ``invalid_city``. Items
+    failing the checks are left out of the statements; each statement runs in a
+    savepoint, so a conflict the checks missed fails only its own items.
+    """
+    statuses = await _check(di, items)
+    groups = {}
+    for item in items:
+        if item['id'] in statuses:
+            continue
+        if isinstance(item.get('birthday'), str):
+            item['birthday'] = find_date(item['birthday'])
+        columns = tuple(sorted(key for key in item if key != 'id'))
+        if columns:
+            groups.setdefault(columns, []).append(item)
+
+    for columns, group in groups.items():
+        try:
+            updated = await _update(di, columns, group)
+        except exceptions.Forbidden:
+            # an email or city changed since the checks: find the offending items one by one
+            updated = set()
+            for item in group:
+                try:
+                    updated |= await _update(di, columns, [item])
+                except exceptions.Forbidden as e:
+                    statuses[item['id']] = FAILURES.get(str(e), 'conflict')
+        for item in group:
+            statuses.setdefault(item['id'], 'updated' if item['id'] in updated else 'not_found')
+    return statuses
+
+
+async def _check(di, items):
+    """Statuses of the items whose email is taken (by another user or an earlier item) or city is missing."""
+    statuses = {}
+    emails = {item['email'] for item in items if item.get('email') is not None}
+    cities = {item['city'] for item in items if item.get('city') is not None}
+    owners = {}
+    if emails:
+        sql = select(table.c.email, table.c.id).where(
+            table.c.email == any_(bindparam('emails', type_=postgresql.ARRAY(String))))
+        owners = {row['email']: row['id'] for row in map(dict, await di.db.list(sql, {'emails': list(emails)}))}
+    if cities:
+        sql = select(City.__table__.c.id).where(
+            City.__table__.c.id == any_(bindparam('cities', type_=postgresql.ARRAY(Integer))))
+        cities = {dict(row)['id'] for row in await di.db.list(sql, {'cities': list(cities)})}
+    for item in items:
+        email, city = item.get('email'), item.get('city')
+        if city is not None and city not in cities:
+            statuses[item['id']] = 'invalid_city'
+        elif email is not None and owners.setdefault(email, item['id']) != item['id']:
+            statuses[item['id']] = 'conflict'
+    return statuses
+
+
+async def _update(di, columns, group):
+    data = {
+        '{}_{}'.format(name, index): item[name]
+        for index, item in enumerate(group) for name in ('id',) + columns
+    }
+    async with di.db.savepoint():
+        rows = await di.db.list(batch_update_sql(list(columns), len(group)), data)
+    return {dict(row)['id'] for row in rows}
+
+
+async def batch_delete(di, ids=None, filters=None):
+    """Deletes users by id list and/or filter in one statement, returns deleted ids."""
+    sql = delete(table)
+    if ids is not None:
+        sql = sql.where(table.c.id == any_(bindparam('ids', type_=postgresql.ARRAY(Integer))))
+    if filters:
+        sql = sql.where(*user_filters(filters))
+    rows = await di.db.list(sql.returning(table.c.id), {'ids': ids} if ids is not None else None)
+    return {dict(row)['id'] for row in rows}
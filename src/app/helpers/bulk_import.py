@@ -0,0 +1,190 @@
+import asyncio
+import csv
+import json
+
+from pydantic import ValidationError
+from sanic import exceptions
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+from app.abs import IDi
+from app.api.model import PrivateCreateUserModel
+from app.model.tables import City, User
+
+from .str_to_date import find_date
+
+MAX_PARAMETERS = 32767
+
+
+class UserImport(IDi):
+    """Streams NDJSON or CSV user rows into the users table chunk by chunk.
+
+    Each chunk is validated, hashed on the password pool and written with one
+    multi-row ``INSERT ... ON CONFLICT (email) DO NOTHING`` in its own
+    transaction, so bad rows and duplicate emails are reported without
+    aborting the rest of the import.
+    """
+
+    def __init__(self, di, csv_format=False) -> None:
+        super().__init__(di)
+        config = di.config.get('bulk_import', {})
+        # one bind parameter per column and row, Postgres takes at most 32767 per statement
+        max_rows = MAX_PARAMETERS // len(PrivateCreateUserModel.__fields__)
+        self._chunk_size = min(int(config.get('chunk_size', 1000)), max_rows)
+        self._max_errors = int(config.get('max_errors', 1000))
+        self._csv = csv_format
+        self._header = None
+        self._record = None
+        self._cities = None
+        self._emails = set()
+        self._chunk = []
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []
+
+    async def run(self, stream):
+        tail = b''
+        line_no = 0
+        while True:
+            data = await stream.read()
+            if data is None:
+                break
+            lines = (tail + data).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                line_no += 1
+                await self._feed(line_no, line)
+        if tail:
+            await self._feed(line_no + 1, tail)
+        if self._record is not None:
+            # the stream ended inside a quoted CSV field
+            self.received += 1
+            self.failed += 1
+            self._error(self._record[0], 'malformed row')
+        await self._flush()
+        return self.report()
+
+    def report(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+    def _error(self, line_no, message):
+        if len(self.errors) < self._max_errors:
+            self.errors.append({'line': line_no, 'error': message})
+
+    async def _feed(self, line_no, line):
+        received = False
+        try:
+            line = line.decode('utf-8-sig')
+            if self._csv:
+                if self._record is not None:
+                    line_no, line = self._record[0], self._record[1] + '\n' + line
+                    self._record = None
+                if line.count('"') % 2:
+                    # a quoted field holds a line break: the record goes on in the next line
+                    self._record = (line_no, line)
+                    return
+            line = line.strip()
+            if not line:
+                return
+            if self._csv and self._header is None:
+                self._header = next(csv.reader([line]))
+                return
+            self.received += 1
+            received = True
+            if self._csv:
+                values = next(csv.reader([line]))
+                row = {key: value for key, value in zip(self._header, values) if value != ''}
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise TypeError(line)
+            if isinstance(row.get('birthday'), str):
+                row['birthday'] = find_date(row['birthday']) or row['birthday']
+            user = PrivateCreateUserModel(**row)
+        except (ValueError, TypeError, csv.Error) as e:
+            # UnicodeDecodeError is a ValueError: an undecodable header or row fails alone
+            if not received:
+                self.received += 1
+            self.failed += 1
+            message = str(e).replace('\n', ' ') if isinstance(e, ValidationError) else 'malformed row'
+            self._error(line_no, message)
+            return
+        self._chunk.append((line_no, user))
+        if len(self._chunk) >= self._chunk_size:
+            await self._flush()
+
+    async def _flush(self):
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        if self._cities is None:
+            self._cities = await self.__city_ids()
+
+        rows = []
+        for line_no, user in chunk:
+            if user.email in self._emails:
+                self.duplicates += 1
+                self._error(line_no, 'email already exists')
+                continue
+            if user.city is not None and user.city not in self._cities:
+                self.failed += 1
+                self._error(line_no, "city_id doesn't exist")
+                continue
+            self._emails.add(user.email)
+            rows.append((line_no, user.dict()))
+        if not rows:
+            return
+
+        hashes = await asyncio.gather(*(self._di.hasher.hash(row.pop('password')) for _, row in rows))
+        for (_, row), password_hash in zip(rows, hashes):
+            row['password_hash'] = password_hash
+
+        try:
+            inserted = await self.__insert(rows)
+        except exceptions.Forbidden:
+            # error_handling turned an IntegrityError into a 403, most likely a city deleted
+            # since the ids were loaded: retry once without the rows referring to it
+            self._cities = await self.__city_ids()
+            missing = [(line_no, row) for line_no, row in rows
+                       if row['city'] is not None and row['city'] not in self._cities]
+            rows = [(line_no, row) for line_no, row in rows
+                    if row['city'] is None or row['city'] in self._cities]
+            self.__fail(missing, "city_id doesn't exist")
+            try:
+                inserted = await self.__insert(rows) if rows else set()
+            except exceptions.Forbidden as e:
+                self.__fail(rows, str(e))
+                return
+        self.inserted += len(inserted)
+        for line_no, row in rows:
+            if row['email'] not in inserted:
+                self.duplicates += 1
+                self._error(line_no, 'email already exists')
+
+    async def __city_ids(self):
+        async with self._di.db.scope():
+            return {row['id'] for row in map(dict, await self._di.db.list(select(City.__table__.c.id)))}
+
+    async def __insert(self, rows):
+        table = User.__table__
+        sql = insert(table).values([row for _, row in rows])
+        sql = sql.on_conflict_do_nothing(index_elements=[table.c.email]).returning(table.c.email)
+        async with self._di.db.scope():
+            inserted = {dict(row)['email'] for row in await self._di.db.list(sql)}
+            if inserted:
+                await self._di.users_count.changed(len(inserted))
+        return inserted
+
+    def __fail(self, rows, message):
+        for line_no, row in rows:
+            self._emails.discard(row['email'])
+            self.failed += 1
+            self._error(line_no, message)
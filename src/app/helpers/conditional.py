@@ -0,0 +1,54 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from hashlib import sha1
+
+from sanic.response import HTTPResponse, empty
+
+from app.cache import CachedResponse
+
+from .json_serializer import json_dumps
+
+
+def make_etag(*parts):
+    return '"{}"'.format(sha1(repr(parts).encode()).hexdigest()[:16])
+
+
+def http_date(value):
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def not_modified(request, etag, last_modified=None):
+    """``If-None-Match`` takes precedence over ``If-Modified-Since`` (RFC 7232, 6)."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = request.headers.get('If-Modified-Since')
+    if since and last_modified is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def validators(etag, last_modified=None):
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag, last_modified=None):
+    return empty(304, headers=validators(etag, last_modified))
+
+
+def cached_json(body, etag, last_modified=None):
+    return CachedResponse(json_dumps(body), etag, last_modified)
+
+
+def conditional_response(request, cached):
+    if not_modified(request, cached.etag, cached.last_modified):
+        return not_modified_response(cached.etag, cached.last_modified)
+    return HTTPResponse(cached.body, headers=validators(cached.etag, cached.last_modified),
+                        content_type='application/json')
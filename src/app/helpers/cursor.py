@@ -0,0 +1,34 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from sanic import exceptions
+
+
+def encode_cursor(sort, direction, values):
+    raw = json.dumps({'s': sort, 'd': direction, 'v': list(values)}, separators=(',', ':'))
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_keys):
+    """``(sort, direction, values)`` of a cursor; ``sort_keys`` maps every sort to its key columns.
+
+    The values must match the types of the key columns: a forged cursor is
+    a 400 here rather than a database error in the keyset ``WHERE``.
+    """
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        sort, direction, values = data['s'], data['d'], data['v']
+    except (BinasciiError, ValueError, TypeError, KeyError):
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    keys = sort_keys.get(sort)
+    if keys is None or len(values) != len(keys):
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    for key, value in zip(keys, values):
+        # keyset keys are never NULL (names are coalesced), so neither are the cursor values
+        if type(value) is not key.type.python_type:
+            raise exceptions.InvalidUsage('Bad Request')
+    return sort, direction, values
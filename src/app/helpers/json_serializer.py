@@ -1,9 +1,28 @@
+import json
+from collections.abc import Mapping
 from datetime import date, datetime
 
+from pydantic import BaseModel
 
-def json_serial(obj):
-    """JSON serializer for objects not serializable by default json code"""
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+def _default(obj):
+    """JSON serializer for objects not serializable by the backend itself"""
+
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
     if isinstance(obj, (datetime, date)):
         return obj.isoformat()
     raise TypeError("Type %s not serializable" % type(obj))
+
+
+def json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
@@ -1,25 +1,98 @@
-from pydantic import ValidationError
 from sanic import exceptions
+from sqlalchemy import String, func, literal_column
 from sqlalchemy.future import select
-from sqlalchemy.sql import func
+from sqlalchemy.sql import tuple_
 
-from app.api.model import CRUDUsersListResponseModel
+from app.api.model import UsersListResponseModel
 from app.model.tables import User
 
+from .conditional import make_etag
+from .cursor import decode_cursor, encode_cursor
+from .serializer import Serializer
 
-async def users_list(di, page, size):
-    table = User.__table__
+table = User.__table__
 
-    count_sql = select(func.count(table.c.id))
-    id_count = await di.db.val(count_sql)
+users_page = Serializer(UsersListResponseModel, exclude_none=True)
+
+
+def _not_null(column):
+    # (NULL, 1) > ('a', 1) is NULL: keyset keys compare NULL names as '', like ix_users_name_keyset
+    return func.coalesce(column, literal_column("''", String)).label(column.name)
+
+
+SORT_KEYS = {
+    'id': (table.c.id,),
+    'name': (_not_null(table.c.last_name), _not_null(table.c.first_name), table.c.id),
+}
+SORT_COLUMNS = {
+    **SORT_KEYS,
+    'last_name': (table.c.last_name, table.c.id),
+    'first_name': (table.c.first_name, table.c.id),
+    'email': (table.c.email,),
+    'birthday': (table.c.birthday, table.c.id),
+    'city': (table.c.city, table.c.id),
+}
+
+
+async def users_list(di, page, size, cursor=None, sort='id', filters=()):
+    """Returns the page body and an ETag built from the row ids, versions and pagination."""
+    if cursor:
+        sort, direction, values = decode_cursor(cursor, SORT_KEYS)
+    else:
+        direction, values = 'next', None
+    if cursor is None:
+        descending = sort.startswith('-')
+        keys = SORT_COLUMNS.get(sort.lstrip('-'))
+        if keys is None:
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        if descending:
+            keys = tuple(key.desc() for key in keys)
+    else:
+        if sort not in SORT_KEYS:
+            raise exceptions.SanicException("Validation Error", status_code=422)
+        keys = SORT_KEYS[sort]
+
+    if filters:
+        id_count, exact = await di.users_count.filtered(filters), True
+    else:
+        id_count, exact = await di.users_count.total()
     len_pages = int(-1 * (id_count / size) // 1 * -1)
 
-    sql = select(table.c.id, table.c.first_name, table.c.last_name, table.c.email)
-    users = await di.db.list(sql, page=page, page_size=size)
+    sql = select(table.c.id, table.c.first_name, table.c.last_name, table.c.email, table.c.version).where(*filters)
+    if cursor is None:
+        users = await di.db.list(sql.order_by(*keys), page=page, page_size=size)
+        pagination = {'total': len_pages, 'exact': exact, 'page': page, 'size': size}
+    else:
+        users, next_cursor, prev_cursor = await _keyset_page(di, sql, keys, sort, direction, values, size)
+        pagination = {'total': len_pages, 'exact': exact, 'size': size,
+                      'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+    users = [dict(row) for row in users]
+    etag = make_etag([(user['id'], user['version']) for user in users], sorted(pagination.items()))
+    return users_page({'data': users, 'meta': {'pagination': pagination}}), etag
+
+
+async def _keyset_page(di, sql, keys, sort, direction, values, size):
+    if direction == 'next':
+        if values is not None:
+            sql = sql.where(tuple_(*keys) > tuple_(*values))
+        sql = sql.order_by(*keys)
+    else:
+        sql = sql.where(tuple_(*keys) < tuple_(*values)).order_by(*[key.desc() for key in keys])
+
+    rows = await di.db.list(sql.limit(size + 1))
+    has_more = len(rows) > size
+    rows = [dict(row) for row in rows[:size]]
+    if direction == 'prev':
+        rows.reverse()
+
+    def row_key(row):
+        return ['' if row[key.name] is None else row[key.name] for key in keys]
 
-    try:
-        data = CRUDUsersListResponseModel.create(users, len_pages, page, size)
-        return data.dict()
-    except ValidationError as e:
-        print(e.json())
-        raise exceptions.SanicException("Validation Error", status_code=422)
+    next_cursor = prev_cursor = None
+    if rows:
+        if direction == 'prev' or has_more:
+            next_cursor = encode_cursor(sort, 'next', row_key(rows[-1]))
+        if (direction == 'next' and values is not None) or (direction == 'prev' and has_more):
+            prev_cursor = encode_cursor(sort, 'prev', row_key(rows[0]))
+    return rows, next_cursor, prev_cursor
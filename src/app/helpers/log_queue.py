@@ -0,0 +1,39 @@
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+
+class LogQueue(object):
+    """Routes the ``app`` loggers through a queue drained by a background thread.
+
+    Log calls on the event loop only enqueue the record. The listener thread
+    does not survive fork, so every worker calls ``start()`` again.
+    """
+
+    def __init__(self, config) -> None:
+        super().__init__()
+        self._queue = SimpleQueue()
+        self._listener = None
+        self._pid = None
+
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s'))
+        self._handler = handler
+
+        app_logger = logging.getLogger('app')
+        app_logger.setLevel(config.get('level', 'INFO'))
+        app_logger.addHandler(QueueHandler(self._queue))
+        app_logger.propagate = False
+
+    def start(self):
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        self._listener = QueueListener(self._queue, self._handler, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = None
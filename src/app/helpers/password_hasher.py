@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+from app.abs import IDi
+
+
+def _method_prefix(method):
+    """The ``method`` part werkzeug writes in front of the salt, ``pbkdf2:<hash>:<iterations>`` for PBKDF2."""
+    if not method.startswith('pbkdf2:'):
+        return method
+    args = method[7:].split(':')
+    iterations = int(args[1] or 0) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+    return 'pbkdf2:{}:{}'.format(args[0], iterations)
+
+
+class PasswordHasher(IDi):
+    """Runs werkzeug password hashing on a worker pool instead of the event loop."""
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('password', {})
+        self.method = config.get('method', 'pbkdf2:sha256:260000')
+        self.salt_length = int(config.get('salt_length', 16))
+        self._executor_kind = config.get('executor', 'thread')
+        self._workers = int(config.get('workers', 4))
+        self._concurrency = int(config.get('concurrency', self._workers))
+        self._executor = None
+        self._semaphore = None
+        self._prefix = _method_prefix(self.method)
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        if self._executor is not None:
+            return
+        executor_class = ProcessPoolExecutor if self._executor_kind == 'process' else ThreadPoolExecutor
+        self._executor = executor_class(max_workers=self._workers)
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def hash_sync(self, password):
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    async def _run(self, fn, *args):
+        self.start()
+        self.waiting += 1
+        start = perf_counter()
+        async with self._semaphore:
+            self.waiting -= 1
+            wait = perf_counter() - start
+            self._wait_total += wait
+            if wait > self._wait_max:
+                self._wait_max = wait
+            self.active += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            finally:
+                self.active -= 1
+                self.completed += 1
+
+    async def hash(self, password):
+        return await self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    async def verify(self, password_hash, password):
+        return await self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        parts = password_hash.split('$')
+        return len(parts) != 3 or parts[0] != self._prefix or len(parts[1]) != self.salt_length
+
+    def stats(self):
+        return {
+            'executor': self._executor_kind,
+            'workers': self._workers,
+            'concurrency': self._concurrency,
+            'waiting': self.waiting,
+            'active': self.active,
+            'completed': self.completed,
+            'wait_avg_ms': round(self._wait_total * 1000 / self.completed, 3) if self.completed else 0.0,
+            'wait_max_ms': round(self._wait_max * 1000, 3),
+        }
@@ -0,0 +1,177 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import tracemalloc
+from datetime import datetime, timezone
+from time import perf_counter
+
+from app.abs import IDi
+from app.cache import LRUCache
+
+
+def _function_name(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return '{}:{}:{}'.format(os.path.basename(filename), line, name)
+
+
+class Profiler(IDi):
+    """cProfile of single requests and tracemalloc snapshot diffs of the worker.
+
+    A request is profiled when an admin sends the ``header`` or when it falls
+    into ``sample_rate``. One profile runs at a time per worker; while it
+    runs, coroutines of other requests on the same loop are profiled too.
+    Profiles are kept in memory (``max_profiles``, ``ttl``) under an id
+    returned in the ``X-Profile-Id`` response header.
+    """
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('profiling', {})
+        self.header = config.get('header', 'X-Profile')
+        self.sample_rate = float(config.get('sample_rate', 0.0))
+        self.timeout = float(config.get('timeout', 60))
+        self.frames = int(config.get('tracemalloc_frames', 10))
+        self._profiles = LRUCache(int(config.get('max_profiles', 20)), float(config.get('ttl', 3600)))
+        self._active = None
+        self._started = 0.0
+        self._seq = 0
+        self._baseline = None
+        self.abandoned = 0
+
+    def trigger(self, request):
+        """``'header'``, ``'sample'`` or ``None``; header requests still need an admin principal."""
+        if self.header in request.headers:
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def start(self):
+        if self._active is not None:
+            if perf_counter() - self._started < self.timeout:
+                return None
+            # the response hook of that request never ran
+            self._active.disable()
+            self.abandoned += 1
+        self._active = cProfile.Profile()
+        self._started = perf_counter()
+        self._active.enable()
+        return self._active
+
+    def stop(self, profile, request, status, trigger):
+        profile.disable()
+        duration = perf_counter() - self._started
+        if self._active is profile:
+            self._active = None
+        self._seq += 1
+        pid = '{}-{}'.format(os.getpid(), self._seq)
+        meta = {
+            'id': pid,
+            'method': request.method,
+            'path': request.path,
+            'route': request.route.name if request.route is not None else None,
+            'status': status,
+            'duration_ms': round(duration * 1000, 3),
+            'trigger': trigger,
+            'created': datetime.now(timezone.utc).isoformat(),
+        }
+        self._profiles.set(pid, (meta, pstats.Stats(profile)))
+        return pid
+
+    def list(self):
+        return [meta for _, (meta, _) in self._profiles.items()]
+
+    def render(self, pid, format='text', sort='cumulative', limit=40):
+        """The profile as ``(body, content type)``: pstats text, a marshalled pstats file or collapsed stacks."""
+        item = self._profiles.get(pid)
+        if item is None:
+            return None
+        meta, stats = item
+        if format == 'pstats':
+            return marshal.dumps(stats.stats), 'application/octet-stream'
+        if format == 'collapsed':
+            return self.__collapsed(stats), 'text/plain; charset=utf-8'
+        stream = io.StringIO()
+        stream.write('{method} {path} -> {status} in {duration_ms} ms ({trigger})\n'.format(**meta))
+        stats.stream = stream
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue(), 'text/plain; charset=utf-8'
+
+    @staticmethod
+    def __collapsed(stats):
+        # cProfile keeps caller -> callee edges only: every function's own time
+        # is put on the chain of its heaviest callers, an approximation of the
+        # real stacks good enough for a flame graph
+        lines = []
+        for func, (_, _, tottime, _, callers) in stats.stats.items():
+            if tottime <= 0:
+                continue
+            stack = [func]
+            seen = {func}
+            while callers and len(stack) < 64:
+                caller = max(callers, key=lambda c: callers[c][3])
+                if caller in seen:
+                    break
+                seen.add(caller)
+                stack.append(caller)
+                callers = stats.stats[caller][4] if caller in stats.stats else None
+            lines.append('{} {}'.format(';'.join(_function_name(f) for f in reversed(stack)), int(tottime * 1e6)))
+        return '\n'.join(sorted(lines)) + '\n'
+
+    def memory_start(self):
+        """Starts tracemalloc (if needed) and takes the baseline snapshot."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = self.__snapshot()
+        return self.memory_status()
+
+    def memory_diff(self, group='lineno', limit=20, reset=False):
+        """Top allocations grown since the baseline, ``None`` when tracing is off."""
+        if not tracemalloc.is_tracing() or self._baseline is None:
+            return None
+        snapshot = self.__snapshot()
+        diff = snapshot.compare_to(self._baseline, group)
+        if reset:
+            self._baseline = snapshot
+        return [
+            {
+                'trace': [str(frame) for frame in stat.traceback],
+                'size_diff': stat.size_diff,
+                'size': stat.size,
+                'count_diff': stat.count_diff,
+                'count': stat.count,
+            }
+            for stat in diff[:limit]
+        ]
+
+    @staticmethod
+    def __snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def memory_stop(self):
+        self._baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return self.memory_status()
+
+    def memory_status(self):
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {'pid': os.getpid(), 'tracing': tracing, 'current': current, 'peak': peak}
+
+    def stats(self):
+        return {
+            'profiles': len(self._profiles),
+            'active': self._active is not None,
+            'abandoned': self.abandoned,
+            'sample_rate': self.sample_rate,
+            'tracemalloc': tracemalloc.is_tracing(),
+        }
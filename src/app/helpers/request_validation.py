@@ -9,15 +9,16 @@ def request_validation(pagination=False, check_token=False, check_pk=False):
         @wraps(fn)
         async def inner(request, *args, **kwargs):
             if pagination:
+                if 'Size' not in request.headers:
+                    raise exceptions.InvalidUsage('Bad Request')
                 try:
-                    page = int(request.headers.get('Page', None))
-                    size = int(request.headers.get('Size', None))
+                    page = int(request.headers.get('Page', 1))
+                    size = int(request.headers['Size'])
                 except ValueError:
                     raise exceptions.SanicException("Validation Error", status_code=422)
-                if not page or not size:
-                    raise exceptions.InvalidUsage('Bad Request')
                 if page < 1 or size < 1:
                     raise exceptions.SanicException("Validation Error", status_code=422)
+                request.ctx.page, request.ctx.size = page, size
 
             if check_token:
                 token = request.cookies.get("token")
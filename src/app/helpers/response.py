@@ -0,0 +1,7 @@
+from sanic.response import HTTPResponse
+
+from .json_serializer import json_dumps
+
+
+def json_response(body, status=200, headers=None):
+    return HTTPResponse(json_dumps(body), status=status, headers=headers, content_type='application/json')
@@ -0,0 +1,80 @@
+import logging
+
+from pydantic import BaseModel, ValidationError
+from pydantic.fields import SHAPE_LIST
+from sanic import exceptions
+
+logger = logging.getLogger(__name__)
+
+
+_REQUIRED = object()
+
+
+def _nested(serializer, many):
+    return serializer.many if many else serializer
+
+
+class Serializer(object):
+    """Builds response dicts shaped like ``model`` from trusted data (DB rows, already validated input).
+
+    The ``(key, default, converter)`` list of the fields is built once per
+    model, nested models convert through their own serializers, and pydantic
+    is bypassed. With ``Serializer.validate`` on (debug) every call goes
+    through the model instead and fails with 422 where the model would.
+    """
+
+    validate = False
+
+    def __init__(self, model, exclude_none=False) -> None:
+        super().__init__()
+        self.model = model
+        self.exclude_none = exclude_none
+        self._dump = self.__build()
+
+    def __build(self):
+        fields = []
+        for field in self.model.__fields__.values():
+            if not field.required:
+                default = field.get_default()
+            elif self.exclude_none:
+                # exclude_none output (a nested page) has dropped the key of a required None
+                default = None
+            else:
+                default = _REQUIRED
+            converter = None
+            if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+                converter = _nested(Serializer(field.type_, self.exclude_none), field.shape == SHAPE_LIST)
+            fields.append((field.alias, default, converter))
+        fields = tuple(fields)
+        exclude_none = self.exclude_none
+
+        def dump(row):
+            get = row.get
+            result = {}
+            for key, default, converter in fields:
+                value = get(key, default)
+                if value is _REQUIRED:
+                    raise KeyError(key)
+                if value is None:
+                    if exclude_none:
+                        continue
+                elif converter is not None:
+                    value = converter(value)
+                result[key] = value
+            return result
+        return dump
+
+    def __call__(self, row):
+        if self.validate:
+            try:
+                return self.model(**row).dict(exclude_none=self.exclude_none)
+            except ValidationError as e:
+                logger.info('response validation failed: %s', e.json())
+                raise exceptions.SanicException("Validation Error", status_code=422)
+        return self._dump(row)
+
+    def many(self, rows):
+        if self.validate:
+            return [self(row) for row in rows]
+        dump = self._dump
+        return [dump(row) for row in rows]
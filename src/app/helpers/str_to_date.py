@@ -1,63 +1,139 @@
-import dateparser
-from dateparser.search import search_dates
+import re
+from datetime import datetime
+from functools import lru_cache
+
+STRICT_FORMATS = (
+    (re.compile(r'\d{4}-\d{1,2}-\d{1,2}'), '%Y-%m-%d'),
+    (re.compile(r'\d{1,2}\.\d{1,2}\.\d{4}'), '%d.%m.%Y'),
+    (re.compile(r'\d{4}\.\d{1,2}\.\d{1,2}'), '%Y.%m.%d'),
+    (re.compile(r'\d{1,2}/\d{1,2}/\d{4}'), '%d/%m/%Y'),
+)
+ISO_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?')
+
+DAY_LIST = {
+    'перво': 1,
+    'второ': 2,
+    'третье': 3,
+    'четвёрто': 4,
+    'четверто': 4,
+    'пято': 5,
+    'шесто': 6,
+    'седьмо': 7,
+    'восьмо': 8,
+    'девято': 9,
+    'десято': 10,
+    'одиннадцато': 11,
+    'двенадцато': 12,
+    'тринадцато': 13,
+    'четырнадцато': 14,
+    'пятнадцато': 15,
+    'шестнадцато': 16,
+    'семнадцато': 17,
+    'восемнадцато': 18,
+    'девятнадцато': 19,
+    'двадцато': 20,
+    'двадцать перво': 21,
+    'двадцать второ': 22,
+    'двадцать третье': 23,
+    'двадцать четвёрто': 24,
+    'двадцать четверто': 24,
+    'двадацать четвёрто': 24,
+    'двадцать пято': 25,
+    'двадцать шесто': 26,
+    'двадцать седьмо': 27,
+    'двадцать восьмо': 28,
+    'двадцать девято': 29,
+    'тридцато': 30,
+    'тридцать перво': 31,
+}
+MONTH_LIST = {
+    'январ': 1,
+    'феврал': 2,
+    'март': 3,
+    'апрел': 4,
+    'ма': 5,
+    'июн': 6,
+    'июл': 7,
+    'август': 8,
+    'сентябр': 9,
+    'октябр': 10,
+    'ноябр': 11,
+    'декабр': 12,
+}
+
+# Longest alternatives first, so 'двадцать пято' wins over 'пято'.
+DAY_MATCHER = re.compile(
+    '|'.join(re.escape(k) for k in sorted(DAY_LIST, key=len, reverse=True))
+)
+WORD_DATE = re.compile(
+    r'\s*(?:(?P<num>\d{1,2})|(?P<word>' + DAY_MATCHER.pattern + r')\w*)\s+'
+    r'(?P<month>январ|феврал|март|апрел|ма(?=[йяе])|июн|июл|август|сентябр|октябр|ноябр|декабр)\w*\s+'
+    r'(?P<year>\d{4})(?:\s*(?:года|г\.?))?\s*',
+    re.IGNORECASE,
+)
 
 
 def find_date(str_date):
-    year_flag = False
-    for index in range(4):
-        if not str_date[index].isdecimal():
-            year_flag = False
-            break
-        elif index > 1:
-            year_flag = True
+    if not str_date:
+        return None
+    str_date = str_date.strip()
+    return parse_exact(str_date) or parse_fallback(str_date)
+
+
+@lru_cache(maxsize=4096)
+def parse_exact(str_date):
+    # only the deterministic tiers are cached: dateparser fills missing parts from today's date
+    return parse_strict(str_date) or parse_words(str_date)
+
+
+def parse_strict(str_date):
+    for pattern, date_format in STRICT_FORMATS:
+        if pattern.fullmatch(str_date):
+            try:
+                return datetime.strptime(str_date, date_format)
+            except ValueError:
+                return None
+    if ISO_DATETIME.fullmatch(str_date):
+        try:
+            return datetime.fromisoformat(str_date)
+        except ValueError:
+            return None
+    return None
+
+
+def parse_words(str_date):
+    match = WORD_DATE.fullmatch(str_date)
+    if match is None:
+        return None
+    if match['num']:
+        day = int(match['num'])
+    else:
+        day = DAY_LIST[match['word'].lower()]
+    month = MONTH_LIST[match['month'].lower()]
+    try:
+        return datetime(int(match['year']), month, day)
+    except ValueError:
+        return None
+
+
+def parse_fallback(str_date):
+    import dateparser
+    from dateparser.search import search_dates
+
+    year_flag = len(str_date) >= 4 and str_date[:4].isdecimal()
     if year_flag:
         date = dateparser.parse(str_date, settings={'DATE_ORDER': 'YMD'})
     else:
         date = dateparser.parse(str_date, settings={'DATE_ORDER': 'DMY'})
     if not date:
-        day_list = {
-            'перво': 1,
-            'второ': 2,
-            'третье': 3,
-            'четвёрто': 4,
-            'пято': 5,
-            'шесто': 6,
-            'седьмо': 7,
-            'восьмо': 8,
-            'девято': 9,
-            'десято': 10,
-            'одиннадцато': 11,
-            'двенадцато': 12,
-            'тринадцато': 13,
-            'четырнадцато': 14,
-            'пятнадцато': 15,
-            'шестнадцато': 16,
-            'семнадцато': 17,
-            'восемнадцато': 18,
-            'девятнадцато': 19,
-            'двадцато': 20,
-            'двадцать перво': 21,
-            'двадцать второ': 22,
-            'двадцать третье': 23,
-            'двадацать четвёрто': 24,
-            'двадцать пято': 25,
-            'двадцать шесто': 26,
-            'двадцать седьмо': 27,
-            'двадцать восьмо': 28,
-            'двадцать девято': 29,
-            'тридцато': 30,
-            'тридцать перво': 31,
-        }
-
         date_raw = search_dates(str_date)
         date = None
         check_num = is_number(str_date)
         if date_raw and not check_num:
-            for k, v in day_list.items():
-                if k in str_date:
-                    digit = v
-                    date_raw = str(digit) + date_raw[0][0]
-                    date = dateparser.parse(date_raw, settings={'DATE_ORDER': 'DMY'})
+            match = DAY_MATCHER.search(str_date)
+            if match:
+                date_raw = str(DAY_LIST[match.group()]) + date_raw[0][0]
+                date = dateparser.parse(date_raw, settings={'DATE_ORDER': 'DMY'})
         elif date_raw and check_num:
             date_raw = check_num + date_raw[0][0]
             date = dateparser.parse(date_raw, settings={'DATE_ORDER': 'DMY'})
@@ -0,0 +1,40 @@
+import logging
+from functools import wraps
+from inspect import isawaitable
+
+from sanic.response import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+
+def unit_of_work(di):
+    """Runs the handler in one session and transaction of ``di.db``.
+
+    The transaction commits when the handler returns a status below 400 and
+    rolls back otherwise, when the handler raises and when the client goes
+    away (the handler task is cancelled and response middleware never runs).
+    A failed commit becomes a 500 that still passes the response middleware.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        async def inner(request, *args, **kwargs):
+            session, token = di.db.begin_scope()
+            try:
+                retval = fn(request, *args, **kwargs)
+                if isawaitable(retval):
+                    retval = await retval
+            except BaseException:
+                try:
+                    await di.db.end_scope(session, token, commit=False)
+                except SQLAlchemyError:
+                    logger.exception('request transaction rollback failed')
+                raise
+            try:
+                await di.db.end_scope(session, token, commit=getattr(retval, 'status', 200) < 400)
+            except SQLAlchemyError:
+                logger.exception('request transaction failed')
+                return text('Internal Server Error', status=500)
+            return retval
+        return inner
+    return decorator
@@ -0,0 +1,63 @@
+import csv
+import io
+import zlib
+
+from sanic import exceptions
+from sqlalchemy.future import select
+
+from app.model.tables import User
+
+from .json_serializer import json_dumps
+from .user_filter import user_filters
+
+table = User.__table__
+
+EXPORT_COLUMNS = [column.name for column in table.c if column.name != 'password_hash']
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _ndjson(columns, rows):
+    return b''.join(json_dumps(dict(row)) + b'\n' for row in rows)
+
+
+def _csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([row[column] for column in columns] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def export_users(di, request):
+    """Streams the users table with a server-side cursor as NDJSON or CSV."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in CONTENT_TYPES:
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    columns = request.args.get('columns')
+    columns = columns.split(',') if columns else EXPORT_COLUMNS
+    if not columns or any(column not in EXPORT_COLUMNS for column in columns):
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    sql = select(*[table.c[column] for column in columns]).where(*user_filters(request.args)).order_by(table.c.id)
+
+    gzip = request.args.get('gzip') in ('1', 'true')
+    # a .gz file rather than Content-Encoding, which clients decode and then save under the .gz name
+    headers = {'Content-Disposition': 'attachment; filename="users.{}{}"'.format(export_format, '.gz' if gzip else '')}
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    encode = _csv if export_format == 'csv' else _ndjson
+
+    content_type = 'application/gzip' if gzip else CONTENT_TYPES[export_format]
+    response = await request.respond(headers=headers, content_type=content_type)
+    if export_format == 'csv':
+        chunk = ','.join(columns).encode() + b'\r\n'
+        await response.send(compressor.compress(chunk) if gzip else chunk)
+    async for rows in di.db.stream(sql):
+        chunk = encode(columns, rows)
+        if gzip:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            await response.send(chunk)
+    if gzip:
+        await response.send(compressor.flush())
+    await response.eof()
@@ -0,0 +1,69 @@
+from datetime import date
+
+from sanic import exceptions
+from sqlalchemy.sql import and_, or_
+
+from app.model.tables import User
+
+table = User.__table__
+
+
+def _bool(value):
+    if value in (True, 'true', '1'):
+        return True
+    if value in (False, 'false', '0'):
+        return False
+    raise ValueError(value)
+
+
+def _date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _starts_with(column, prefix):
+    """``column LIKE prefix%`` plus its range in byte order.
+
+    A B-tree can serve ``LIKE`` only for a prefix known at plan time, not for
+    a parameter of a generic plan (asyncpg prepares every statement); the
+    ``~>=~`` / ``~<~`` range on the ``varchar_pattern_ops`` index works for both.
+    """
+    conditions = [column.startswith(prefix, autoescape=True), column.op('~>=~', is_comparison=True)(prefix)]
+    upper = ord(prefix[-1]) + 1
+    if upper not in (0xD800, 0x110000):
+        conditions.append(column.op('~<~', is_comparison=True)(prefix[:-1] + chr(upper)))
+    return and_(*conditions)
+
+
+def user_filters(args):
+    """SQL conditions on the users table built from request query arguments.
+
+    Every condition is served by an index declared on ``User``: ``city``,
+    ``is_admin`` and ``birthday`` by plain B-trees, ``prefix`` by the
+    ``varchar_pattern_ops`` indexes and ``search`` by the trigram indexes.
+    """
+    conditions = []
+    try:
+        if 'city' in args:
+            conditions.append(table.c.city == int(args.get('city')))
+        if 'is_admin' in args:
+            conditions.append(table.c.is_admin == _bool(args.get('is_admin')))
+        if 'birthday_from' in args:
+            conditions.append(table.c.birthday >= _date(args.get('birthday_from')))
+        if 'birthday_to' in args:
+            conditions.append(table.c.birthday <= _date(args.get('birthday_to')))
+    except (TypeError, ValueError):
+        raise exceptions.SanicException("Validation Error", status_code=422)
+    if args.get('prefix'):
+        prefix = args.get('prefix')
+        conditions.append(or_(
+            _starts_with(table.c.last_name, prefix),
+            _starts_with(table.c.first_name, prefix),
+            _starts_with(table.c.email, prefix),
+        ))
+    if args.get('search'):
+        search = args.get('search')
+        conditions.append(or_(
+            table.c.last_name.contains(search, autoescape=True),
+            table.c.first_name.contains(search, autoescape=True),
+        ))
+    return conditions
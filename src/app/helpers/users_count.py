@@ -0,0 +1,88 @@
+from time import monotonic
+
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+from sqlalchemy.sql import text as text_
+
+from app.abs import IDi
+from app.db import statements
+from app.model.tables import User
+
+
+class UsersCount(IDi):
+    """Source of the total number of users shown in list pagination.
+
+    ``total()`` returns a ``(count, exact)`` pair, ``changed()`` is called by
+    the handlers that insert or delete users inside the request transaction.
+    """
+
+    async def total(self):
+        raise NotImplementedError
+
+    async def changed(self, delta):
+        pass
+
+    async def exact_count(self):
+        return await self._di.db.val(statements.users_count)
+
+    async def filtered(self, conditions):
+        return await self._di.db.val(select(func.count(User.__table__.c.id)).where(*conditions))
+
+
+class ExactUsersCount(UsersCount):
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        self._ttl = float(di.config.get('count', {}).get('ttl', 10))
+        self._value = None
+        self._expires = 0.0
+
+    async def total(self):
+        now = monotonic()
+        if self._value is not None and now < self._expires:
+            return self._value, False
+        self._value = await self.exact_count()
+        self._expires = now + self._ttl
+        return self._value, True
+
+    async def changed(self, delta):
+        self._value = None
+
+
+class CounterUsersCount(UsersCount):
+
+    name = 'users'
+
+    async def total(self):
+        value = await self._di.db.val(statements.counter_value, {'name': self.name})
+        if value is None:
+            value = await self.exact_count()
+            await self._di.db.exec(statements.counter_init, {'name': self.name, 'value': value})
+        return value, True
+
+    async def changed(self, delta):
+        await self._di.db.exec(statements.counter_add, {'name': self.name, 'delta': delta})
+
+
+class EstimateUsersCount(UsersCount):
+
+    sql = statements.named('users_estimate',
+                           text_("SELECT reltuples::bigint FROM pg_class WHERE oid = 'users'::regclass"))
+
+    async def total(self):
+        value = await self._di.db.val(self.sql)
+        if value is None or value < 0:
+            return await self.exact_count(), True
+        return value, False
+
+
+STRATEGIES = {
+    'exact': ExactUsersCount,
+    'counter': CounterUsersCount,
+    'estimate': EstimateUsersCount,
+}
+
+
+def users_count(di):
+    strategy = di.config.get('count', {}).get('strategy', 'exact')
+    return STRATEGIES[strategy](di)
@@ -0,0 +1,2 @@
+from .registry import Counter, Histogram, Metrics
+from .service import ServiceMetrics
@@ -0,0 +1,163 @@
+from bisect import bisect_left
+from math import inf
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild(object):
+    __slots__ = ('value',)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class HistogramChild(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric(object):
+    """A metric family; ``labels(*values)`` returns the child holding the values.
+
+    Children are meant to be looked up once (at startup or on the first use
+    of a label set) and kept by the caller, so recording is an attribute
+    update without locks: every worker is a single event loop thread.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()) -> None:
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, labels, _number(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def _child(self):
+        return CounterChild()
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _labels(self.labelnames, values), child.value
+
+
+class Histogram(Metric):
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (inf,), child.counts):
+                total += count
+                yield self.name + '_bucket', _labels(self.labelnames, values, ('le', _number(bound))), total
+            labels = _labels(self.labelnames, values)
+            yield self.name + '_sum', labels, child.sum
+            yield self.name + '_count', labels, total
+
+
+class Collected(Metric):
+    """Values read at scrape time from ``collect()``: an iterable of ``(label values, value)``."""
+
+    def __init__(self, name, documentation, labelnames, collect, type='gauge') -> None:
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self._collect = collect
+
+    def samples(self):
+        for values, value in self._collect():
+            yield self.name, _labels(self.labelnames, values), value
+
+
+class Metrics(object):
+    """Registry rendered by ``/metrics`` in the Prometheus text format (0.0.4).
+
+    The registry is per worker process: with ``web.workers`` > 1 every scrape
+    sees the counters of the worker that served it.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, prefix='') -> None:
+        super().__init__()
+        self.prefix = prefix
+        self._metrics = {}
+
+    def __add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('metric {!r} is already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.__add(Counter(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.__add(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def collected(self, name, documentation, labelnames, collect, type='gauge'):
+        return self.__add(Collected(self.prefix + name, documentation, labelnames, collect, type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,170 @@
+from app.abs import IDi
+from app.db.statements import STATEMENTS
+
+from .registry import Metrics
+
+
+class RouteMetrics(object):
+    __slots__ = ('labels', 'latency', 'statuses', '_requests')
+
+    def __init__(self, requests, latency, labels) -> None:
+        self.labels = labels
+        self.latency = latency.labels(*labels)
+        self.statuses = {}
+        self._requests = requests
+
+    def status(self, status):
+        child = self.statuses.get(status)
+        if child is None:
+            child = self.statuses[status] = self._requests.labels(*self.labels, str(status))
+        return child
+
+
+class ServiceMetrics(IDi):
+    """Metrics of this service: HTTP by route, DB statements, pool, caches, admission and the password hasher.
+
+    Route label sets are allocated by ``prepare()`` once the blueprints are
+    registered, so ``observe()`` is two dict lookups and three increments.
+    Pool, cache and hasher values are read from their ``stats()`` at scrape
+    time and cost nothing between scrapes.
+    """
+
+    CACHES = ('principals', 'responses', 'tokens')
+
+    def __init__(self, di) -> None:
+        super().__init__(di)
+        config = di.config.get('metrics', {})
+        self.registry = Metrics(config.get('prefix', ''))
+        self.requests = self.registry.counter(
+            'http_requests_total', 'HTTP requests by route and status.', ('blueprint', 'route', 'method', 'status'))
+        self.latency = self.registry.histogram(
+            'http_request_duration_seconds', 'HTTP request latency by route, middleware and commit included.',
+            ('blueprint', 'route', 'method'))
+        self.statements = self.registry.histogram(
+            'db_statement_duration_seconds', 'Statement execution time by statement name.', ('statement',))
+        self.registry.collected(
+            'db_pool_connections', 'Connections of the worker pool by state.', ('state',), self.__pool)
+        self.registry.collected(
+            'db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection.', (),
+            self.__pool_wait, type='counter')
+        self.registry.collected(
+            'db_replica_up', 'Replica usable for reads: healthy and within db.replica_max_lag.', ('replica',),
+            self.__replica_up)
+        self.registry.collected(
+            'db_replica_lag_seconds', 'Replay lag reported by the last replica check.', ('replica',),
+            self.__replica_lag)
+        self.registry.collected(
+            'db_reads_total', 'Reads by target: a replica or the primary (sticky, fallback).', ('target',),
+            self.__reads, type='counter')
+        self.registry.collected(
+            'db_statement_cache_hit_ratio', 'Share of executions served by the compiled statement cache.',
+            ('cache',), self.__statement_caches)
+        self.registry.collected(
+            'cache_requests_total', 'Lookups of in-process caches by result.', ('cache', 'result'),
+            self.__cache_requests, type='counter')
+        self.registry.collected(
+            'cache_hit_ratio', 'Hit ratio of in-process caches since start.', ('cache',), self.__cache_ratios)
+        self.registry.collected(
+            'cache_entries', 'Entries held by in-process caches.', ('cache',), self.__cache_sizes)
+        self.registry.collected(
+            'password_hash_tasks', 'Password hash tasks by state: waiting for a slot or running.', ('state',),
+            self.__hasher)
+        self.registry.collected(
+            'password_hash_completed_total', 'Password hash tasks completed.', (), self.__hasher_completed,
+            type='counter')
+        self.registry.collected(
+            'admission_rejected_total', 'Requests rejected by admission control: shed (503) or throttled (429).',
+            ('route', 'reason'), self.__admission, type='counter')
+        self._routes = {}
+        self._unmatched = RouteMetrics(self.requests, self.latency, ('', '', ''))
+        di.db.query_log.histogram = self.statements
+
+    def prepare(self, app):
+        """Allocates the label sets of every registered route and named statement."""
+        for route in app.router.routes:
+            parts = route.name.split('.')
+            blueprint = parts[1] if len(parts) > 2 else ''
+            labels = (blueprint, '/' + route.path, ','.join(sorted(route.methods)))
+            self._routes[route.name] = RouteMetrics(self.requests, self.latency, labels)
+        for name in tuple(STATEMENTS) + ('adhoc',):
+            self.statements.labels(name)
+
+    def observe(self, request, status, duration):
+        route = request.route
+        metrics = self._routes.get(route.name, self._unmatched) if route is not None else self._unmatched
+        metrics.latency.observe(duration)
+        metrics.status(status).inc()
+
+    def render(self):
+        return self.registry.render()
+
+    def __pool(self):
+        status = self._di.db.pool_status()
+        if status is None:
+            return
+        for state in ('checked_out', 'idle'):
+            yield (state,), status[state]
+
+    def __pool_wait(self):
+        status = self._di.db.pool_status()
+        if status is not None:
+            yield (), status['wait']['total_ms'] / 1000
+
+    def __replicas(self):
+        status = self._di.db.replica_status()
+        return status['replicas'] if status is not None else ()
+
+    def __replica_up(self):
+        for replica in self.__replicas():
+            yield (replica['name'],), int(replica['healthy'])
+
+    def __replica_lag(self):
+        for replica in self.__replicas():
+            if replica['lag'] is not None:
+                yield (replica['name'],), replica['lag']
+
+    def __reads(self):
+        status = self._di.db.replica_status()
+        if status is None:
+            return
+        yield ('primary',), status['primary_reads']
+        for replica in status['replicas']:
+            yield (replica['name'],), replica['reads']
+
+    def __statement_caches(self):
+        stats = self._di.db.query_log.stats()
+        yield ('compiled',), stats['compiled_hit_rate']
+
+    def __caches(self):
+        for name in self.CACHES:
+            yield name, getattr(self._di, name).stats()
+
+    def __cache_requests(self):
+        for name, stats in self.__caches():
+            yield (name, 'hit'), stats['hits']
+            yield (name, 'miss'), stats['misses']
+
+    def __cache_ratios(self):
+        for name, stats in self.__caches():
+            total = stats['hits'] + stats['misses']
+            yield (name,), stats['hits'] / total if total else 0.0
+
+    def __cache_sizes(self):
+        for name, stats in self.__caches():
+            yield (name,), stats['size']
+        yield ('cities',), self._di.cities.stats()['size']
+
+    def __hasher(self):
+        stats = self._di.hasher.stats()
+        yield ('waiting',), stats['waiting']
+        yield ('active',), stats['active']
+
+    def __admission(self):
+        for route, stats in self._di.admission.stats()['routes'].items():
+            for reason, key, name in (('shed', 'concurrency', 'shed'), ('ip', 'per_ip', 'rejected'),
+                                      ('login', 'per_login', 'rejected')):
+                if stats[key] is not None:
+                    yield (route, reason), stats[key][name]
+
+    def __hasher_completed(self):
+        yield (), self._di.hasher.stats()['completed']
@@ -1,2 +1,3 @@
 from .city import City
+from .counter import Counter
 from .user import User
@@ -0,0 +1,10 @@
+from sqlalchemy import BigInteger, Column, String
+
+from app.db import Db
+
+
+class Counter(Db.Base):
+    __tablename__ = 'counters'
+
+    name = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
@@ -1,10 +1,24 @@
-from sqlalchemy import Boolean, Column, Date, ForeignKey, Integer, String
+from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Index,
+                        Integer, String, func, literal_column)
 
 from app.db import Db
 
 
 class User(Db.Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_name_keyset', func.coalesce(literal_column('last_name'), literal_column("''")),
+              func.coalesce(literal_column('first_name'), literal_column("''")), 'id'),
+        Index('ix_users_is_admin', 'is_admin'),
+        Index('ix_users_birthday', 'birthday'),
+        Index('ix_users_last_name_pattern', 'last_name', postgresql_ops={'last_name': 'varchar_pattern_ops'}),
+        Index('ix_users_first_name_pattern', 'first_name', postgresql_ops={'first_name': 'varchar_pattern_ops'}),
+        Index('ix_users_email_pattern', 'email', postgresql_ops={'email': 'varchar_pattern_ops'}),
+        Index('ix_users_last_name_trgm', 'last_name', postgresql_using='gin',
+              postgresql_ops={'last_name': 'gin_trgm_ops'}),
+        Index('ix_users_first_name_trgm', 'first_name', postgresql_using='gin',
+              postgresql_ops={'first_name': 'gin_trgm_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     first_name = Column(String)
@@ -17,3 +31,5 @@ class User(Db.Base):
     additional_info = Column(String)
     is_admin = Column(Boolean)
     password_hash = Column(String)
+    version = Column(Integer, nullable=False, server_default='1')
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,352 @@
+"""Load test of the HTTP API: latency percentiles, RPS and DB queries per request.
+
+Run from ``src`` against a running server and the database it uses
+(``docker-compose up pgsql`` is enough for a disposable one; apply
+``python start.py migrate`` first):
+
+    python -m bench.api --seed-users 10000 --concurrency 32 --requests 2000 --out report.json
+    python -m bench.api --baseline report.json --tolerance 0.2
+
+Seeds ``--seed-users`` users (``bench<N>@example.com``, password ``bench``)
+and ``--seed-cities`` cities, logs in as the configured admin and as one
+seeded user, then drives every scenario in ``SCENARIOS`` with
+``--concurrency`` keep-alive connections. DB queries per request are read
+from the ``X-DB-Queries`` header, sent when the server runs with
+``web.query_count_header: True``. With ``--baseline`` the run exits with
+status 1 when a scenario's p95 latency or queries per request grew, or its
+RPS dropped, by more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from sqlalchemy.sql import func
+
+import app.api  # noqa: F401  (resolves the app.helpers import cycle)
+from app.cache import CityRegistry
+from app.helpers import PasswordHasher
+from app.model.tables import City, User
+
+from .common import make_di
+
+PASSWORD = 'bench'
+EMAIL = 'bench{}@example.com'
+
+
+class Response(object):
+
+    def __init__(self, status, headers, body) -> None:
+        super().__init__()
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Connection(object):
+    """Minimal HTTP/1.1 keep-alive client; responses must carry Content-Length."""
+
+    def __init__(self, host, port) -> None:
+        super().__init__()
+        self._host = host
+        self._port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, headers=None, body=None):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        payload = b'' if body is None else json.dumps(body).encode()
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}:{}'.format(self._host, self._port),
+                 'Content-Length: {}'.format(len(payload))]
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.extend('{}: {}'.format(key, value) for key, value in (headers or {}).items())
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            await self.close()
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = (await self._reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+        length = int(response_headers.get('content-length', 0))
+        response_body = await self._reader.readexactly(length) if length else b''
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return Response(status, response_headers, response_body)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def seed(di, users, cities):
+    """Inserts the bench users and cities through the same counters as the handlers."""
+    password_hash = PasswordHasher(di).hash_sync(PASSWORD)
+    await di.db.connect(replicas=False)
+    try:
+        city_table, user_table = City.__table__, User.__table__
+        if cities:
+            rows = [{'name': 'Bench city {}'.format(index)} for index in range(cities)]
+            sql = insert(city_table).values(rows).on_conflict_do_nothing().returning(city_table.c.id)
+            async with di.db.scope():
+                if await di.db.list(sql):
+                    await CityRegistry(di).changed()
+        city_ids = [dict(row)['id'] for row in await di.db.list(select(city_table.c.id))] or [None]
+        rows = [
+            {'first_name': 'Bench', 'last_name': 'User{:07d}'.format(index), 'email': EMAIL.format(index),
+             'is_admin': False, 'city': city_ids[index % len(city_ids)], 'password_hash': password_hash}
+            for index in range(users)
+        ]
+        rows.append({'first_name': 'Bench', 'last_name': 'Login', 'email': EMAIL.format('login'), 'is_admin': False,
+                     'city': None, 'password_hash': password_hash})
+        for start in range(0, len(rows), 1000):
+            sql = insert(user_table).values(rows[start:start + 1000])
+            sql = sql.on_conflict_do_nothing(index_elements=['email']).returning(user_table.c.id)
+            async with di.db.scope():
+                inserted = await di.db.list(sql)
+                if inserted:
+                    await di.users_count.changed(len(inserted))
+        ids = [dict(row)['id'] for row in await di.db.list(
+            select(user_table.c.id).where(user_table.c.email.like('bench%@example.com')))]
+        login_id = await di.db.val(select(user_table.c.id).where(user_table.c.email == EMAIL.format('login')))
+        total = await di.db.val(select(func.count(user_table.c.id)))
+    finally:
+        await di.db.disconnect()
+    return ids, login_id, total
+
+
+class Context(object):
+    """Cookies and ids the scenarios need, shared by all workers of a run."""
+
+    def __init__(self, args, admin_cookie, user_cookie, user_id, ids) -> None:
+        super().__init__()
+        self.admin = {'Cookie': admin_cookie}
+        self.user = {'Cookie': user_cookie}
+        self.user_id = user_id
+        self.ids = ids
+        self.size = args.size
+        self.created = []
+        self.counter = itertools.count()
+
+
+def page(ctx, headers):
+    return {**headers, 'Page': str(random.randint(1, 20)), 'Size': str(ctx.size)}
+
+
+def user_body(ctx, index):
+    return {'first_name': 'Bench', 'last_name': 'Created{}'.format(index), 'is_admin': False,
+            'email': 'bench-created-{}-{}@example.com'.format(random.getrandbits(32), index)}
+
+
+async def scenario_login(conn, ctx):
+    return await conn.request('POST', '/login', body={'login': EMAIL.format('login'), 'password': PASSWORD})
+
+
+async def scenario_users_current(conn, ctx):
+    return await conn.request('GET', '/users/current', ctx.user)
+
+
+async def scenario_users_list(conn, ctx):
+    return await conn.request('GET', '/users/', page(ctx, ctx.user))
+
+
+async def scenario_users_list_filtered(conn, ctx):
+    return await conn.request('GET', '/users/?prefix=User00&sort=name', page(ctx, ctx.user))
+
+
+async def scenario_user_patch(conn, ctx):
+    body = {'first_name': 'Bench', 'last_name': 'Login', 'email': EMAIL.format('login'),
+            'phone': str(next(ctx.counter))}
+    return await conn.request('PATCH', '/users/{}'.format(ctx.user_id), ctx.user, body)
+
+
+async def scenario_private_list(conn, ctx):
+    return await conn.request('GET', '/private/users', page(ctx, ctx.admin))
+
+
+async def scenario_private_get(conn, ctx):
+    return await conn.request('GET', '/private/users/{}'.format(random.choice(ctx.ids)), ctx.admin)
+
+
+async def scenario_private_create(conn, ctx):
+    index = next(ctx.counter)
+    response = await conn.request('POST', '/private/users/', ctx.admin, {**user_body(ctx, index), 'password': 'x'})
+    if response.status == 201:
+        ctx.created.append(response.json()['id'])
+    return response
+
+
+async def scenario_private_patch(conn, ctx):
+    pk = random.choice(ctx.created or ctx.ids)
+    return await conn.request('PATCH', '/private/users/{}'.format(pk), ctx.admin, user_body(ctx, pk))
+
+
+async def scenario_private_delete(conn, ctx):
+    if not ctx.created:
+        return None
+    return await conn.request('DELETE', '/private/users/{}'.format(ctx.created.pop()), ctx.admin)
+
+
+async def scenario_cities(conn, ctx):
+    return await conn.request('GET', '/private/cities/', ctx.admin)
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'users_current': scenario_users_current,
+    'users_list': scenario_users_list,
+    'users_list_filtered': scenario_users_list_filtered,
+    'user_patch': scenario_user_patch,
+    'private_list': scenario_private_list,
+    'private_get': scenario_private_get,
+    'private_create': scenario_private_create,
+    'private_patch': scenario_private_patch,
+    'private_delete': scenario_private_delete,
+    'cities': scenario_cities,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_scenario(url, ctx, fn, requests, concurrency):
+    latencies, queries, errors = [], [], 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        conn = Connection(url.hostname, url.port or 80)
+        try:
+            while next(remaining) < requests:
+                start = perf_counter()
+                try:
+                    response = await fn(conn, ctx)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    errors += 1
+                    await conn.close()
+                    continue
+                if response is None:
+                    return
+                latencies.append(perf_counter() - start)
+                if response.status >= 400:
+                    errors += 1
+                if 'x-db-queries' in response.headers:
+                    queries.append(int(response.headers['x-db-queries']))
+        finally:
+            await conn.close()
+
+    start = perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = perf_counter() - start
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'db_queries': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+async def login(url, email, password):
+    conn = Connection(url.hostname, url.port or 80)
+    try:
+        response = await conn.request('POST', '/login', body={'login': email, 'password': password})
+    finally:
+        await conn.close()
+    if response.status != 200:
+        raise SystemExit('login as {} failed: {}'.format(email, response.status))
+    cookie = response.headers['set-cookie'].split(';', 1)[0]
+    return cookie
+
+
+async def main(args):
+    di = make_di()
+    ids, login_id, total = await seed(di, args.seed_users, args.seed_cities)
+    url = urlsplit(args.url)
+    admin = di.config['db_admin']
+    admin_cookie = await login(url, admin['email'], admin['password'])
+    user_cookie = await login(url, EMAIL.format('login'), PASSWORD)
+    ctx = Context(args, admin_cookie, user_cookie, login_id, ids)
+
+    names = args.scenario or list(SCENARIOS)
+    report = {
+        'config': {'users': total, 'concurrency': args.concurrency, 'requests': args.requests, 'size': args.size},
+        'scenarios': {},
+    }
+    for name in names:
+        report['scenarios'][name] = await run_scenario(url, ctx, SCENARIOS[name], args.requests, args.concurrency)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Returns the regressions of ``report`` against ``baseline``."""
+    regressions = []
+    for name, current in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if base.get('p95_ms') and current['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {} ms > baseline {} ms'.format(name, current['p95_ms'], base['p95_ms']))
+        if base.get('rps') and current['rps'] and current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append('{}: {} rps < baseline {} rps'.format(name, current['rps'], base['rps']))
+        if base.get('db_queries') is not None and current['db_queries'] is not None \
+                and current['db_queries'] > base['db_queries'] * (1 + tolerance):
+            regressions.append('{}: {} queries/request > baseline {}'.format(
+                name, current['db_queries'], base['db_queries']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--seed-users', type=int, default=10000)
+    parser.add_argument('--seed-cities', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help='per scenario')
+    parser.add_argument('--size', type=int, default=50, help='page size of list scenarios')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS))
+    parser.add_argument('--out', help='write the report to this file')
+    parser.add_argument('--baseline', help='report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,26 @@
+import os
+
+from dotenv import dotenv_values, load_dotenv
+from pyaml_env import parse_config
+
+from app.db import Db
+from app.di import DI
+from app.helpers import users_count
+
+SRC_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def load_config():
+    load_dotenv()
+    return {
+        **parse_config(os.path.join(SRC_ROOT, 'config.yml')),
+        **dict(dotenv_values()),
+        **dict(os.environ),
+    }
+
+
+def make_di():
+    di = DI(config=load_config())
+    di.add(db=Db(di))
+    di.add(users_count=users_count(di))
+    return di
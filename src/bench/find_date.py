@@ -0,0 +1,37 @@
+"""Compare the tiers of ``app.helpers.str_to_date.find_date``.
+
+Run from ``src``: ``python -m bench.find_date [--number N]``
+"""
+import argparse
+import json
+from timeit import Timer
+
+import app.api  # noqa: F401  (resolves the app.helpers import cycle)
+from app.helpers.str_to_date import (find_date, parse_fallback, parse_strict,
+                                     parse_words)
+
+CASES = {
+    'strict': (parse_strict, ['1990-01-02', '02.01.1990', '1990-01-02T10:20:30']),
+    'words': (parse_words, ['пятое мая 1990', 'двадцать пятое декабря 1985 года', '5 мая 1990']),
+    'dateparser': (parse_fallback, ['02.01.1990', 'пятое мая 1990', '12 Jan 1990']),
+    'cached': (find_date, ['1990-01-02', 'пятое мая 1990', '5 мая 1990']),
+}
+
+
+def bench(number):
+    parse_fallback('01.01.2000')
+    report = {}
+    for tier, (fn, values) in CASES.items():
+        for value in values:
+            fn(value)
+        timer = Timer(lambda: [fn(value) for value in values])
+        seconds = min(timer.repeat(repeat=3, number=number))
+        report[tier] = {'us_per_call': round(seconds / (number * len(values)) * 1e6, 3)}
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.number), indent=2))
@@ -0,0 +1,67 @@
+"""Per-row cost of building list and detail responses: pydantic models vs ``Serializer``.
+
+Run from ``src``: ``python -m bench.serializers [--number N]``
+"""
+import argparse
+import json
+from datetime import date
+from timeit import Timer
+
+import app.api  # noqa: F401  (resolves the app.helpers import cycle)
+from app.api.model import (PrivateDetailUserResponseModel,
+                           UsersListResponseModel)
+from app.helpers import Serializer, json_dumps
+
+PAGE_SIZES = (100, 1000)
+
+
+def user_rows(count):
+    return [
+        {
+            'id': index, 'first_name': 'Ivan{}'.format(index), 'last_name': 'Petrov',
+            'email': 'user{}@example.com'.format(index), 'other_name': None, 'phone': '+7900{:07d}'.format(index),
+            'birthday': date(1990, 1, 1 + index % 28), 'city': 1, 'additional_info': None, 'is_admin': False,
+            'version': 1,
+        }
+        for index in range(count)
+    ]
+
+
+def page(rows):
+    return {'data': rows, 'meta': {'pagination': {'total': 10, 'exact': True, 'page': 1, 'size': len(rows)}}}
+
+
+def variants():
+    page_serializer = Serializer(UsersListResponseModel, exclude_none=True)
+    detail_serializer = Serializer(PrivateDetailUserResponseModel)
+    return {
+        'list': {
+            'pydantic': lambda rows: UsersListResponseModel(**page(rows)).dict(exclude_none=True),
+            'serializer': lambda rows: page_serializer(page(rows)),
+        },
+        'detail': {
+            'pydantic': lambda rows: [PrivateDetailUserResponseModel(**row).dict() for row in rows],
+            'serializer': lambda rows: detail_serializer.many(rows),
+        },
+    }
+
+
+def bench(number):
+    report = {}
+    for shape, fns in variants().items():
+        for size in PAGE_SIZES:
+            rows = user_rows(size)
+            for name, fn in fns.items():
+                json_dumps(fn(rows))
+                seconds = min(Timer(lambda: fn(rows)).repeat(repeat=3, number=number))
+                report.setdefault(shape, {}).setdefault(size, {})[name] = {
+                    'us_per_row': round(seconds / (number * size) * 1e6, 3),
+                }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.number), indent=2))
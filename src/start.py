@@ -6,11 +6,17 @@ from dotenv import dotenv_values, load_dotenv
 from pyaml_env import parse_config
 from sanic import Sanic
 from sqlalchemy.future import select
-from werkzeug.security import generate_password_hash
 
-from app.api import auth_api, private_user_api, user_api
-from app.db import Db
+from app.api import (TokenVerifier, auth_api, auth_middleware, city_api,
+                     metrics_api, metrics_middleware, private_user_api,
+                     profiling_api, profiling_middleware,
+                     query_count_middleware, service_api, user_api)
+from app.cache import CityRegistry, PrincipalCache, ResponseCache
+from app.db import Db, Migrator
 from app.di import DI
+from app.helpers import (Admission, LogQueue, PasswordHasher, Profiler,
+                         Serializer, users_count)
+from app.metrics import ServiceMetrics
 from app.model.tables import User
 
 
@@ -22,6 +28,23 @@ def get_root():
         return config_path
 
 
+def migrate(di, args):
+    migrator = Migrator(di)
+    if args[:1] == ['status']:
+        current, target, pending = asyncio.run(migrator.status())
+        print(f'schema version: {current}, expected: {target}')
+        for migration in pending:
+            print(f'pending {migration.version:04d}: {migration.description}')
+        return 1 if pending else 0
+    di.logs.start()
+    try:
+        applied = asyncio.run(migrator.upgrade())
+    finally:
+        di.logs.stop()
+    print(f'applied migrations: {applied}' if applied else 'schema is up to date')
+    return 0
+
+
 if __name__ == "__main__":
     load_dotenv()
 
@@ -42,11 +65,41 @@ if __name__ == "__main__":
         config=config,
     )
 
+    di.add(logs=LogQueue(config.get('logging', {})))
+    Serializer.validate = bool(config.get('serializers', {}).get('validate', False))
     di.add(db=Db(di))
+    di.add(users_count=users_count(di))
+    di.add(principals=PrincipalCache(di))
+    di.add(cities=CityRegistry(di))
+    di.add(responses=ResponseCache(di))
+    di.add(tokens=TokenVerifier(di))
+    di.add(hasher=PasswordHasher(di))
+    di.add(admission=Admission(di))
+    metrics_enabled = bool(config.get('metrics', {}).get('enabled', False))
+    if metrics_enabled:
+        di.add(metrics=ServiceMetrics(di))
+    profiling_enabled = bool(config.get('profiling', {}).get('enabled', False))
+    if profiling_enabled:
+        di.add(profiler=Profiler(di))
 
-    app.blueprint(auth_api(di))
-    app.blueprint(user_api(di))
-    app.blueprint(private_user_api(di))
+    if sys.argv[1:2] == ['migrate']:
+        sys.exit(migrate(di, sys.argv[2:]))
+
+    blueprints = (auth_api(di), user_api(di), private_user_api(di))
+    if profiling_enabled:
+        profiling_middleware(di, *blueprints)
+    for blueprint in blueprints:
+        app.blueprint(blueprint)
+    app.blueprint(city_api(di))
+    app.blueprint(service_api(di))
+    if profiling_enabled:
+        app.blueprint(profiling_api(di))
+    if metrics_enabled:
+        app.blueprint(metrics_api(di))
+        metrics_middleware(di)
+    auth_middleware(di)
+    if di.config['web'].get('query_count_header', False):
+        query_count_middleware(di)
     app.config['OAS_UI_DEFAULT'] = 'swagger'
     app.config['OAS_URL_PREFIX'] = '/swagger'
 
@@ -62,13 +115,39 @@ if __name__ == "__main__":
         last_name=first_admin_dict['last_name'],
         email=first_admin_dict['email'],
         is_admin=first_admin_dict['is_admin'],
-        password_hash=generate_password_hash(first_admin_dict['password'])
+        password_hash=di.hasher.hash_sync(first_admin_dict['password'])
     )
     sql = select(User.__table__.c.is_admin).where(User.email == first_admin.email)
-    asyncio.run(di.db.db_start(sql, first_admin))
 
+    @app.listener('main_process_start')
+    async def db_start(app_, loop):
+        di.logs.start()
+        await di.db.db_start(sql, first_admin)
+
+    @app.listener('main_process_stop')
+    async def logs_stop(app_, loop):
+        di.logs.stop()
+
+    @app.listener('before_server_start')
+    async def db_connect(app_, loop):
+        di.logs.start()
+        await di.db.connect()
+        await di.cities.load()
+        di.hasher.start()
+        if metrics_enabled:
+            di.metrics.prepare(app_)
+
+    @app.listener('after_server_stop')
+    async def db_disconnect(app_, loop):
+        di.hasher.stop()
+        await di.db.disconnect()
+        di.logs.stop()
+
+    fast = bool(di.config['web'].get('fast', False))
     app.run(
         host=di.config['web']['host'],
         port=di.config['web']['port'],
+        workers=1 if fast else int(di.config['web'].get('workers', 1)),
+        fast=fast,
         debug=False,
     )
@@ -0,0 +1,117 @@
+"""Checks with EXPLAIN that every user list filter and sort is served by an index.
+
+The statements are prepared with bound parameters and planned with
+``plan_cache_mode = force_generic_plan``, the plan asyncpg's prepared
+statements end up with, so a condition that needs the parameter value at
+plan time (a ``LIKE :q || '%'`` on a B-tree) fails here. Sequential scans
+are disabled, so the check holds on small tables too. Needs a database
+with the current schema (``python start.py migrate``), skipped without one.
+"""
+import asyncio
+import json
+import re
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.future import select
+
+import app.api  # noqa: F401  (resolves the app.helpers import cycle)
+from app.db import Db
+from app.di import DI
+from app.helpers import user_filters
+from app.helpers.list_of_users import SORT_COLUMNS
+from app.model.tables import User
+from bench.common import load_config
+
+table = User.__table__
+dialect = postgresql.dialect(paramstyle='numeric')
+
+FILTERS = {
+    'city': ({'city': '1'}, {'ix_users_city'}),
+    'is_admin': ({'is_admin': 'true'}, {'ix_users_is_admin'}),
+    'birthday_from': ({'birthday_from': '1990-01-01'}, {'ix_users_birthday'}),
+    'birthday_to': ({'birthday_to': '1990-01-01'}, {'ix_users_birthday'}),
+    'prefix': ({'prefix': 'Iv'}, {'ix_users_last_name_pattern', 'ix_users_first_name_pattern',
+                                  'ix_users_email_pattern'}),
+    'search': ({'search': 'van'}, {'ix_users_last_name_trgm', 'ix_users_first_name_trgm'}),
+}
+SORTS = {
+    'id': {'users_pkey'},
+    'name': {'ix_users_name_keyset'},
+    'email': {'users_email_key'},
+    'birthday': {'ix_users_birthday'},
+    'city': {'ix_users_city'},
+}
+
+CASES = {'filter ' + name: (args, None, indexes) for name, (args, indexes) in FILTERS.items()}
+CASES.update({'sort ' + name: ({}, name, indexes) for name, indexes in SORTS.items()})
+
+
+@pytest.fixture(scope='module')
+def config():
+    config = load_config()
+    if config['db'].get('db_name') in (None, '', 'N/A'):
+        pytest.skip('no database configured')
+    return config
+
+
+def statement(args, sort):
+    sql = select(table.c.id, table.c.first_name, table.c.last_name, table.c.email).where(*user_filters(args))
+    if sort is not None:
+        sql = sql.order_by(*SORT_COLUMNS[sort])
+    return sql.limit(20)
+
+
+def prepared(sql):
+    """``PREPARE`` and ``EXPLAIN EXECUTE`` of ``sql``, the parameters passed as typed literals."""
+    compiled = sql.compile(dialect=dialect)
+    names = compiled.positiontup
+    params = compiled.construct_params()
+    types = [compiled.binds[name].type.compile(dialect=dialect) for name in names]
+    values = ["'{}'::{}".format(str(params[name]).replace("'", "''"), type_) for name, type_ in zip(names, types)]
+    query = re.sub(r'(?<!:):(\d+)', r'$\1', str(compiled))
+    # the asyncpg adapter %-formats every statement
+    return (
+        'PREPARE explained ({}) AS {}'.format(', '.join(types), query).replace('%', '%%'),
+        'EXPLAIN (FORMAT JSON) EXECUTE explained ({})'.format(', '.join(values)).replace('%', '%%'),
+    )
+
+
+def scans(plan):
+    """``(node type, index name)`` of every scan in the plan tree."""
+    found = set()
+    if plan['Node Type'].endswith('Scan'):
+        found.add((plan['Node Type'], plan.get('Index Name')))
+    for child in plan.get('Plans', []):
+        found |= scans(child)
+    return found
+
+
+async def explain(config, sql):
+    """Scans of the generic plan of ``sql`` and the extensions installed in the database."""
+    di = DI(config=config)
+    db = Db(di)
+    await db.connect(replicas=False)
+    try:
+        async with db.engine.connect() as conn:
+            await conn.exec_driver_sql('SET plan_cache_mode = force_generic_plan')
+            await conn.exec_driver_sql('SET enable_seqscan = off')
+            prepare, execute = prepared(sql)
+            await conn.exec_driver_sql(prepare)
+            plan = (await conn.exec_driver_sql(execute)).scalar()
+            extensions = {row[0] for row in await conn.exec_driver_sql('SELECT extname FROM pg_extension')}
+    finally:
+        await db.disconnect()
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    return scans(plan[0]['Plan']), extensions
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_served_by_index(config, name):
+    args, sort, indexes = CASES[name]
+    found, extensions = asyncio.run(explain(config, statement(args, sort)))
+    if 'search' in args and 'pg_trgm' not in extensions:
+        pytest.skip('pg_trgm is not installed')
+    assert all(node in ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan', 'Bitmap Heap Scan')
+               for node, _ in found), found
+    assert {index for _, index in found} & indexes, found